@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Local stand-in for the SpyFu API: serves synthetic (or recorded) responses for every path main.py calls.
+# Run it standalone and point the app at it with SPYFU_HOST=127.0.0.1:8765 SPYFU_SCHEME=http
+
+DOMAIN_STATS_PATH = "/apis/domain_stats_api/v2/getDomainStatsForExactDate"
+PPC_KEYWORDS_PATH = "/apis/keyword_api/v2/ppc/getMostSuccessful"
+AD_HISTORY_PATH = "/apis/ad_history_api/domain_ad_history_with_metrics"
+VALUABLE_KEYWORDS_PATH = "/apis/serp_api/v2/seo/getMostValuableKeywords"
+NEWLY_RANKED_KEYWORDS_PATH = "/apis/serp_api/v2/seo/getNewlyRankedKeywords"
+GAINED_CLICKS_KEYWORDS_PATH = "/apis/serp_api/v2/seo/getGainedClicksKeywords"
+
+KEYWORD_PATHS = (PPC_KEYWORDS_PATH, VALUABLE_KEYWORDS_PATH, NEWLY_RANKED_KEYWORDS_PATH, GAINED_CLICKS_KEYWORDS_PATH)
+ALL_PATHS = (DOMAIN_STATS_PATH, AD_HISTORY_PATH) + KEYWORD_PATHS
+
+
+# Behaviour of the stand-in server, shared by every request handler
+class MockConfig:
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, keyword_rows=1000, ad_keywords=50,
+                 ads_per_keyword=3, top_ads=20, recorded_dir=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.keyword_rows = keyword_rows
+        self.ad_keywords = ad_keywords
+        self.ads_per_keyword = ads_per_keyword
+        self.top_ads = top_ads
+        self.recorded_dir = recorded_dir
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def count(self, error, size):
+        with self._lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.bytes_sent += size
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "bytes_sent": self.bytes_sent}
+
+
+# Function to build a deterministic synthetic keyword row for a domain
+def keyword_row(domain, i):
+    return {
+        "keyword": f"{domain.split('.')[0]} keyword {i}",
+        "searchVolume": 100000 // i,
+        "seoClicks": round(5000 / i, 2),
+        "rank": i % 50 + 1,
+        "totalMonthlyClicks": round(2500 / i, 2),
+        "percentPaidClicks": round((i % 100) / 100, 2),
+        "broadMonthlyCost": round(10000 / i, 2),
+        "broadCostPerClick": round(0.2 + (i % 40) / 10, 2),
+    }
+
+
+# Function to build the synthetic payload of a path for the given query parameters
+def synthetic_payload(config, path, params):
+    if path == DOMAIN_STATS_PATH:
+        return {"results": [{
+            "searchMonth": int(params.get("month", 6)),
+            "searchYear": int(params.get("year", 2024)),
+            "averageOrganicRank": 12.4,
+            "totalOrganicResults": 48210,
+            "monthlyOrganicClicks": 1250000,
+            "totalAdsPurchased": 3120,
+            "monthlyPaidClicks": 84512.37,
+            "monthlyBudget": 152300,
+        }]}
+    if path == AD_HISTORY_PATH:
+        domain = params.get("d", "example.com")
+        keywords = []
+        for i in range(1, config.ad_keywords + 1):
+            keywords.append({
+                "keyword": f"{domain.split('.')[0]} ad keyword {i}",
+                "exact_cpc": round(0.3 + i / 100, 2),
+                "exact_daily_clicks": 1000 // i,
+                "ads": [{"title": f"Ad {i}.{j} title", "body": f"Ad {i}.{j} body copy for {domain}",
+                         "position": j + 1, "search_date_id": 20240101 + j} for j in range(config.ads_per_keyword)],
+            })
+        top_ads = [{"ad_id": str(100000 + i), "title": f"Top ad {i}", "body": f"Top ad {i} body copy",
+                    "avg_ad_pos": round(1 + i / 10, 2), "avg_total_ads": 4.0, "coverage": round(1 / (i + 1), 3)}
+                   for i in range(config.top_ads)]
+        return {"keywords": keywords, "top_ads": top_ads}
+    domain = params.get("query", "example.com")
+    start = int(params.get("startingRow", 1))
+    size = int(params.get("pageSize", 10))
+    end = min(start + size, config.keyword_rows + 1)
+    return {"totalMatchingResults": config.keyword_rows,
+            "results": [keyword_row(domain, i) for i in range(start, end)]}
+
+
+# Function to load a recorded response for a path, when one was saved for it
+def recorded_payload(config, path):
+    if not config.recorded_dir:
+        return None
+    file_path = os.path.join(config.recorded_dir, path.rsplit("/", 1)[-1] + ".json")
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Function to create a request handler class bound to a configuration
+def make_handler(config):
+    class SpyFuHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            time.sleep(max(0.0, config.latency + config.random.uniform(-config.jitter, config.jitter)))
+            if url.path not in ALL_PATHS:
+                self._respond(404, {"error": f"unknown path {url.path}"})
+            elif config.random.random() < config.error_rate:
+                self._respond(503, {"error": "injected failure"}, {"Retry-After": "0"})
+            else:
+                payload = recorded_payload(config, url.path)
+                self._respond(200, payload if payload is not None else synthetic_payload(config, url.path, params))
+
+        def _respond(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            config.count(status >= 400, len(body))
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return SpyFuHandler
+
+
+# Function to start the stand-in server on a background thread; returns the server, its port is server.server_port
+def start_server(config, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Serve synthetic SpyFu API responses locally.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Random +/- seconds around the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 503")
+    parser.add_argument("--keyword-rows", type=int, default=1000, help="Rows available to each keyword endpoint")
+    parser.add_argument("--ad-keywords", type=int, default=50, help="Keywords in each ad history response")
+    parser.add_argument("--recorded-dir", default=None,
+                        help="Directory of recorded responses named after the last path segment, e.g. getMostSuccessful.json")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        keyword_rows=args.keyword_rows, ad_keywords=args.ad_keywords,
+                        recorded_dir=args.recorded_dir, seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    print(f"Mock SpyFu API on http://{args.host}:{server.server_port} "
+          f"(set SPYFU_HOST={args.host}:{server.server_port} SPYFU_SCHEME=http)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(config.stats()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime, timezone
+
+from mock_spyfu import MockConfig, start_server
+
+# Offline benchmarks for main.py against the local SpyFu stand-in:
+#   python benchmarks/run_benchmarks.py --competitors 1,10,50,200
+#   python benchmarks/run_benchmarks.py --compare benchmarks/results/<baseline>.json
+# Each run writes a JSON file that later runs can be compared against to catch regressions.
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+# Normalization step behind each dashboard table: (endpoint whose payload it reads, builder name)
+NORMALIZERS = {
+    "valuable_keywords": ("valuable_keywords", "build_keywords_df"),
+    "newly_ranked_keywords": ("newly_ranked_keywords", "build_newly_ranked_keywords_df"),
+    "gained_clicks_keywords": ("gained_clicks_keywords", "build_gained_clicks_keywords_df"),
+    "ppc_keywords": ("ppc_keywords", "build_ppc_keywords_df"),
+    "ad_history": ("ad_history", "build_ad_history_df"),
+    "top_ads": ("ad_history", "build_top_ads_df"),
+}
+
+# Timed fields compared between runs, lower is better
+COMPARED_FIELDS = ("fetch_s", "parse_s", "normalize_total_s", "create_excel_s", "peak_traced_mb")
+
+
+# Function to import main.py configured to talk to the stand-in server
+def load_app(server_port, cache_dir):
+    os.environ["SPYFU_HOST"] = f"127.0.0.1:{server_port}"
+    os.environ["SPYFU_SCHEME"] = "http"
+    os.environ["SPYFU_CACHE_DIR"] = cache_dir
+    sys.path.insert(0, REPO_ROOT)
+    import main as app
+    return app
+
+
+# Function to give the app a cold response cache and fresh client, metrics and rate limits
+def reset_app(app, cache_dir, rate_limit):
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(cache_dir)
+    app.CACHE_DIR = cache_dir
+    app.get_spyfu_client.clear()
+    app.get_response_cache.clear()
+    app.get_metrics().reset()
+    for family in app.RATE_LIMITS:
+        app.RATE_LIMITS[family] = rate_limit
+    app.DEFAULT_RATE_LIMIT = rate_limit
+
+
+# Function to run one fetch, normalize and export pass; returns the timings of each step
+def run_pipeline(app, domains, args):
+    client = app.get_spyfu_client(app.SPYFU_API_ID, app.SPYFU_SECRET_KEY)
+    jobs = app.build_seo_jobs(domains, client, args.month, args.year, args.country, args.keyword_limit)
+    jobs.update(app.build_sea_jobs(domains, client, args.month, args.year, args.country, args.keyword_limit))
+    start = time.perf_counter()
+    results, _, _ = app.fetch_all(jobs, max_workers=args.max_workers)
+    fetch_s = time.perf_counter() - start
+    errors = sum(isinstance(result, app.SpyFuError) for result in results.values())
+
+    normalize_s = {}
+    for table, (endpoint, builder_name) in NORMALIZERS.items():
+        build_fn = getattr(app, builder_name)
+        start = time.perf_counter()
+        for d in domains:
+            data = results[(d, endpoint)]
+            if not isinstance(data, app.SpyFuError):
+                build_fn(data)
+        normalize_s[table] = time.perf_counter() - start
+
+    # Export the same tables the dashboard offers for download
+    start = time.perf_counter()
+    domains_data = {}
+    for d in domains:
+        domains_data[d] = {}
+        for endpoint in app.SEO_ENDPOINTS + app.SEA_ENDPOINTS:
+            data = results[(d, endpoint)]
+            if not isinstance(data, app.SpyFuError):
+                domains_data[d].update(app.normalize_section(endpoint, data)["tables"])
+    section_s = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as export_dir:
+        excel_path = os.path.join(export_dir, "export.xlsx")
+        start = time.perf_counter()
+        app.create_excel(domains_data, excel_path)
+        create_excel_s = time.perf_counter() - start
+        excel_bytes = os.path.getsize(excel_path)
+
+    return {
+        "requests": len(jobs),
+        "fetch_errors": errors,
+        "fetch_s": fetch_s,
+        "normalize_s": normalize_s,
+        "normalize_total_s": sum(normalize_s.values()),
+        "normalize_sections_s": section_s,
+        "create_excel_s": create_excel_s,
+        "excel_bytes": excel_bytes,
+        "table_rows": sum(len(df) for tables in domains_data.values() for df in tables.values()),
+    }
+
+
+# Function to benchmark one competitor count: a timed pass, then a pass under tracemalloc for peak memory
+def run_scenario(app, competitors, args, cache_dir):
+    domains = ["main-domain.example"] + [f"competitor{i}.example" for i in range(1, competitors + 1)]
+
+    reset_app(app, cache_dir, args.rate_limit)
+    result = run_pipeline(app, domains, args)
+    snapshot = app.get_metrics().snapshot()
+    result["bytes_transferred"] = snapshot["totals"]["bytes"]
+    result["estimated_credits"] = snapshot["totals"]["credits"]
+    result["parse_s"] = sum(row["total_s"] for row in snapshot["metrics"] if row["stage"] == "parse")
+
+    reset_app(app, cache_dir, args.rate_limit)
+    tracemalloc.start()
+    try:
+        run_pipeline(app, domains, args)
+        result["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+    return {"competitors": competitors, "domains": len(domains), **result}
+
+
+# Function to describe the code and machine a result file was produced on
+def run_metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import pandas as pd
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+    }
+
+
+# Function to compare a run against a baseline result file; returns the regressions past the threshold
+def compare_results(current, baseline, threshold):
+    baseline_by_count = {s["competitors"]: s for s in baseline["scenarios"]}
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('git_commit')} ({baseline['meta'].get('timestamp')}):")
+    for scenario in current["scenarios"]:
+        base = baseline_by_count.get(scenario["competitors"])
+        if base is None:
+            continue
+        for field in COMPARED_FIELDS:
+            if not base.get(field) or field not in scenario:
+                continue
+            ratio = scenario[field] / base[field]
+            flag = " REGRESSION" if ratio > 1 + threshold else ""
+            print(f"  {scenario['competitors']:>4} competitors  {field:<18} {base[field]:>9.3f} -> "
+                  f"{scenario[field]:>9.3f}  ({ratio:.2f}x){flag}")
+            if flag:
+                regressions.append((scenario["competitors"], field, ratio))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark main.py against a local SpyFu stand-in server.")
+    parser.add_argument("--competitors", default="1,10,50,200", help="Comma separated competitor counts")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mock server latency per response, seconds")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock responses that are HTTP 503")
+    parser.add_argument("--keyword-rows", type=int, default=1000, help="Rows available to each keyword endpoint")
+    parser.add_argument("--ad-keywords", type=int, default=50, help="Keywords in each ad history response")
+    parser.add_argument("--keyword-limit", type=int, default=100, help="Keyword rows requested per endpoint")
+    parser.add_argument("--max-workers", type=int, default=32)
+    parser.add_argument("--rate-limit", type=float, default=10000.0,
+                        help="Requests per second allowed per endpoint family (SpyFu's real limits throttle far lower)")
+    parser.add_argument("--month", type=int, default=6)
+    parser.add_argument("--year", type=int, default=2024)
+    parser.add_argument("--country", default="FR")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Result file, defaults to benchmarks/results/<commit>-<time>.json")
+    parser.add_argument("--compare", default=None, help="Baseline result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        keyword_rows=args.keyword_rows, ad_keywords=args.ad_keywords, seed=args.seed)
+    server = start_server(config)
+    cache_dir = tempfile.mkdtemp(prefix="spyfu-bench-")
+    try:
+        app = load_app(server.server_port, cache_dir)
+        scenarios = []
+        for competitors in (int(c) for c in args.competitors.split(",")):
+            scenario = run_scenario(app, competitors, args, cache_dir)
+            scenarios.append(scenario)
+            print(f"{competitors:>4} competitors: fetch {scenario['fetch_s']:.2f}s ({scenario['requests']} jobs, "
+                  f"{scenario['fetch_errors']} errors), normalize {scenario['normalize_total_s']:.3f}s, "
+                  f"create_excel {scenario['create_excel_s']:.2f}s, peak {scenario['peak_traced_mb']:.1f} MB")
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    results = {"meta": run_metadata(args), "server": config.stats(), "scenarios": scenarios}
+    output = args.output
+    if output is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join(RESULTS_DIR, f"{results['meta']['git_commit'] or 'local'}-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare_results(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
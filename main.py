@@ -1,244 +1,1034 @@
 import streamlit as st
 import pandas as pd
+import xlsxwriter
 import http.client
 import json
 import base64
-from io import BytesIO
-from datetime import datetime
-
-# Set page layout to full width
-st.set_page_config(layout="wide")
+import os
+import re
+import sys
+import argparse
+import time
+import random
+import sqlite3
+import queue
+import atexit
+import threading
+import hashlib
+import zipfile
+import importlib.util
+import weakref
+import contextvars
+import numpy as np
+from contextlib import closing, contextmanager
+from collections import Counter, OrderedDict, defaultdict, deque
+from io import BytesIO, TextIOWrapper
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode, urlsplit
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+# SpyFu API location, overridable to point the app at a local stand-in server (host may include a port)
+SPYFU_HOST = os.environ.get("SPYFU_HOST", "www.spyfu.com")
+SPYFU_SCHEME = os.environ.get("SPYFU_SCHEME", "https")
+SPYFU_API_ID = os.environ.get("SPYFU_API_ID", "356b218d-0d19-412c-83aa-2fafa98384cb")
+SPYFU_SECRET_KEY = os.environ.get("SPYFU_SECRET_KEY", "J6VPTMMZ")
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+HAS_CALAMINE = importlib.util.find_spec("python_calamine") is not None
+HAS_ORJSON = importlib.util.find_spec("orjson") is not None
+HAS_MSGSPEC = importlib.util.find_spec("msgspec") is not None
+if HAS_ORJSON:
+    import orjson
+if HAS_MSGSPEC:
+    import msgspec
+CACHE_DIR = os.environ.get("SPYFU_CACHE_DIR", ".cache")
+CACHE_MAX_BYTES = int(os.environ.get("SPYFU_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+DOMAIN_STATS_PATH = "/apis/domain_stats_api/v2/getDomainStatsForExactDate"
+
+# Cache lifetime in seconds per endpoint, None means the response never expires
+ENDPOINT_TTLS = {
+    DOMAIN_STATS_PATH: 6 * 3600,
+    "/apis/serp_api/v2/seo/getNewlyRankedKeywords": 6 * 3600,
+    "/apis/serp_api/v2/seo/getGainedClicksKeywords": 12 * 3600,
+    "/apis/serp_api/v2/seo/getMostValuableKeywords": 24 * 3600,
+    "/apis/keyword_api/v2/ppc/getMostSuccessful": 24 * 3600,
+    "/apis/ad_history_api/domain_ad_history_with_metrics": 24 * 3600,
+}
+
+# Function to build a cache key from the endpoint and its normalized query parameters
+def cache_key(path, params):
+    normalized = sorted((str(k), str(v).strip().lower()) for k, v in params.items())
+    return f"{path}?{urlencode(normalized)}"
+
+# Function to pick the cache TTL of a request
+def cache_ttl(path, params):
+    if path == DOMAIN_STATS_PATH:
+        # Stats for a month that is already over never change
+        today = datetime.now()
+        if (int(params["year"]), int(params["month"])) < (today.year, today.month):
+            return None
+    return ENDPOINT_TTLS.get(path, 3600)
+
+# Persistent SQLite response cache with per-entry TTL and size-bounded LRU eviction
+class ResponseCache:
+    def __init__(self, path, max_bytes=CACHE_MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, endpoint TEXT, body BLOB, size INTEGER, "
+            "created_at REAL, expires_at REAL, accessed_at REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (accessed_at)")
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT body, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, endpoint, body, ttl):
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, endpoint, body, len(body), now, expires_at, now))
+            self._evict()
+            self._db.commit()
+
+    # Drop least recently used entries until the cache fits its size budget
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def size(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+# Requests per second allowed for each endpoint family (the /apis/<family>/ path segment)
+RATE_LIMITS = {
+    "domain_stats_api": 5.0,
+    "serp_api": 5.0,
+    "keyword_api": 5.0,
+    "ad_history_api": 2.0,
+}
+DEFAULT_RATE_LIMIT = 5.0
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Estimated SpyFu API credits charged per returned row for each endpoint family
+CREDITS_PER_ROW = {
+    "domain_stats_api": 1.0,
+    "serp_api": 1.0,
+    "keyword_api": 1.0,
+    "ad_history_api": 1.0,
+}
+DEFAULT_CREDITS_PER_ROW = 1.0
+
+# Function to count the rows of a SpyFu payload, a single record counts as one row
+def payload_row_count(payload):
+    if isinstance(payload, list):
+        return len(payload)
+    if isinstance(payload, dict):
+        for key in ("results", "keywords"):
+            if isinstance(payload.get(key), list):
+                return len(payload[key])
+    return 1 if payload else 0
+
+# Errors raised by the JSON decoders for malformed bodies
+JSON_DECODE_ERRORS = (ValueError, msgspec.MsgspecError) if HAS_MSGSPEC else (ValueError,)
+
+# Function to decode a JSON body straight from bytes, with orjson when available
+def decode_json(data):
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Base error for SpyFu requests that could not be completed
+class SpyFuError(Exception):
+    def __init__(self, message, path=None, status=None):
+        super().__init__(message)
+        self.path = path
+        self.status = status
+
+# SpyFu kept throttling the request after every retry, or asked for a longer wait than the client allows
+class SpyFuRateLimitError(SpyFuError):
+    pass
+
+# SpyFu kept failing with a 5xx status or the connection kept failing
+class SpyFuServerError(SpyFuError):
+    pass
+
+# SpyFu rejected the request (bad credentials, bad parameters...)
+class SpyFuClientError(SpyFuError):
+    pass
+
+# Requests to an endpoint family are suspended after repeated failures
+class SpyFuCircuitOpenError(SpyFuError):
+    pass
+
+# Function to get the endpoint family of an API path
+def endpoint_family(path):
+    parts = path.strip("/").split("/")
+    return parts[1] if len(parts) > 1 else path
+
+# Function to read a Retry-After header given in seconds or as an HTTP date
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+# Token bucket shared by every fetch thread of an endpoint family
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Circuit breaker that stops calling an endpoint family after consecutive failures
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_after=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def check(self, path):
+        with self._lock:
+            if self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_after:
+                raise SpyFuCircuitOpenError(
+                    f"{endpoint_family(path)} is failing repeatedly, requests are paused for {self.reset_after:.0f}s", path)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+# Thread-safe timings and counters for each (stage, name) of the pipeline: fetch, request, parse, normalize, render, export
+class Metrics:
+    def __init__(self, max_samples=5000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now(timezone.utc)
+            self._durations = defaultdict(lambda: deque(maxlen=self.max_samples))
+            self._counts = defaultdict(Counter)
+
+    def record(self, stage, name, seconds=None, counts=None):
+        with self._lock:
+            # Only timed records count as calls; untimed ones only add counts to the same key
+            if seconds is not None:
+                self._durations[(stage, name)].append(seconds)
+                self._counts[(stage, name)]["calls"] += 1
+            self._counts[(stage, name)].update(counts or {})
+
+    # Time a block; the yielded Counter collects extra counts such as bytes or cache hits
+    @contextmanager
+    def measure(self, stage, name):
+        counts = Counter()
+        start = time.perf_counter()
+        try:
+            yield counts
+        except BaseException:
+            counts["errors"] += 1
+            raise
+        finally:
+            self.record(stage, name, time.perf_counter() - start, counts)
+
+    def summary(self):
+        with self._lock:
+            keys = sorted(set(self._durations) | set(self._counts))
+            durations = {key: list(self._durations.get(key, ())) for key in keys}
+            counts = {key: Counter(self._counts.get(key, {})) for key in keys}
+        rows = []
+        for stage, name in keys:
+            times = pd.Series(durations[(stage, name)], dtype="float64")
+            count = counts[(stage, name)]
+            lookups = count["cache_hits"] + count["cache_misses"]
+            rows.append({
+                "stage": stage,
+                "name": name,
+                "calls": count["calls"],
+                "errors": count["errors"],
+                "p50_ms": round(times.quantile(0.5) * 1000, 1) if len(times) else None,
+                "p95_ms": round(times.quantile(0.95) * 1000, 1) if len(times) else None,
+                "total_s": round(times.sum(), 3),
+                "bytes": count["bytes"],
+                "rows": count["rows"],
+                "cache_hits": count["cache_hits"],
+                "cache_hit_rate": round(count["cache_hits"] / lookups, 3) if lookups else None,
+                "coalesced": count["coalesced"],
+                "credits": count["credits"],
+                "statuses": {k[len("status_"):]: v for k, v in sorted(count.items()) if k.startswith("status_")},
+            })
+        return rows
+
+    def snapshot(self):
+        rows = self.summary()
+        return {
+            "started_at": self.started_at.isoformat(),
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "totals": {
+                "bytes": sum(row["bytes"] for row in rows if row["stage"] == "request"),
+                "credits": sum(row["credits"] for row in rows if row["stage"] == "request"),
+            },
+            "metrics": rows,
+        }
+
+# Pooled keep-alive HTTPS client shared by every SpyFu fetcher
+class SpyFuClient:
+    def __init__(self, api_id, secret_key, host=SPYFU_HOST, pool_size=64, timeout=60, cache=None,
+                 rate_limits=None, max_retries=4, backoff_base=0.5, backoff_max=30.0, retry_after_max=120.0,
+                 metrics=None, scheme=SPYFU_SCHEME):
+        credentials = f"{api_id}:{secret_key}"
+        encoded_credentials = base64.b64encode(credentials.encode("utf-8")).decode("utf-8")
+        self.headers = {'Authorization': f'Basic {encoded_credentials}', 'Connection': 'keep-alive'}
+        self.host = host
+        self.connection_class = http.client.HTTPConnection if scheme == "http" else http.client.HTTPSConnection
+        self.timeout = timeout
+        self.cache = cache
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._inflight = {}
+        self.rate_limits = {**RATE_LIMITS, **(rate_limits or {})}
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self._buckets = {}
+        self._breakers = {}
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.coalesced_requests = 0
+        self.retries = 0
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.host, timeout=self.timeout)
+
+    def _release(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _count(self, reused):
+        with self._lock:
+            if reused:
+                self.reused_connections += 1
+            else:
+                self.new_connections += 1
+
+    # Return the raw response body and whether it came from the network,
+    # concurrent callers for the same key share one request
+    def request(self, path, params):
+        key = cache_key(path, params)
+        with self._lock:
+            pending = self._inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._inflight[key] = Future()
+            else:
+                self.coalesced_requests += 1
+        if not owner:
+            self.metrics.record("request", path, counts={"coalesced": 1})
+            return pending.result(), False
+        try:
+            with self.metrics.measure("request", path) as counts:
+                data, from_network = self._fetch(key, path, params)
+                if from_network:
+                    counts["bytes"] += len(data)
+                if self.cache is not None:
+                    counts["cache_misses" if from_network else "cache_hits"] += 1
+        except BaseException as exc:
+            pending.set_exception(exc)
+            raise
+        else:
+            pending.set_result(data)
+            return data, from_network
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    # Fetch a response body, served from the response cache when possible
+    def _fetch(self, key, path, params):
+        if self.cache is None:
+            return self._send_with_retry(path, params), True
+        data = self.cache.get(key)
+        if data is not None:
+            return data, False
+        data = self._send_with_retry(path, params)
+        self.cache.put(key, path, data, cache_ttl(path, params))
+        return data, True
+
+    def _family_guards(self, path):
+        family = endpoint_family(path)
+        with self._lock:
+            if family not in self._buckets:
+                self._buckets[family] = TokenBucket(self.rate_limits.get(family, DEFAULT_RATE_LIMIT))
+                self._breakers[family] = CircuitBreaker()
+            return self._buckets[family], self._breakers[family]
+
+    # Send a rate-limited request, retrying throttled and transient failures with jittered backoff
+    def _send_with_retry(self, path, params):
+        bucket, breaker = self._family_guards(path)
+        for attempt in range(self.max_retries + 1):
+            breaker.check(path)
+            bucket.acquire()
+            retry_after = None
+            try:
+                status, data, retry_after_header = self._send(path, params)
+            except (http.client.HTTPException, OSError) as exc:
+                self.metrics.record("request", path, counts={"status_error": 1})
+                error = SpyFuServerError(f"{path} request failed: {exc}", path)
+            else:
+                self.metrics.record("request", path, counts={f"status_{status}": 1})
+                if status < 400:
+                    breaker.record_success()
+                    return data
+                message = f"{path} returned HTTP {status}: {data[:200].decode('utf-8', 'replace')}"
+                if status not in RETRYABLE_STATUSES:
+                    raise SpyFuClientError(message, path, status)
+                error_type = SpyFuRateLimitError if status == 429 else SpyFuServerError
+                error = error_type(message, path, status)
+                retry_after = parse_retry_after(retry_after_header)
+            breaker.record_failure()
+            if attempt == self.max_retries:
+                raise error
+            if retry_after is not None and retry_after > self.retry_after_max:
+                # Waiting that long would stall the whole run, so report the throttle instead
+                raise error_type(f"{message} (Retry-After {retry_after:.0f}s exceeds {self.retry_after_max:.0f}s)",
+                                 path, status)
+            with self._lock:
+                self.retries += 1
+            if retry_after is None:
+                # Full jitter: a random delay up to the exponential backoff bound
+                retry_after = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            time.sleep(retry_after)
+
+    # Send a GET request on a pooled connection and return the status, raw body and Retry-After header
+    def _send(self, path, params):
+        url = f"{path}?{urlencode(params)}"
+        conn = self._acquire()
+        reused = conn.sock is not None
+        try:
+            try:
+                conn.request("GET", url, headers=self.headers)
+                res = conn.getresponse()
+                data = res.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive socket, retry once on a fresh one
+                reused = False
+                conn.request("GET", url, headers=self.headers)
+                res = conn.getresponse()
+                data = res.read()
+        except BaseException:
+            conn.close()
+            raise
+        self._count(reused)
+        if res.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        return res.status, data, res.getheader("Retry-After")
+
+    # Decode a response with the given decoder, which takes the raw bytes
+    def get_json(self, path, params, decoder=decode_json):
+        data, from_network = self.request(path, params)
+        with self.metrics.measure("parse", path) as counts:
+            try:
+                payload = decoder(data)
+            except JSON_DECODE_ERRORS as exc:
+                raise SpyFuServerError(f"{path} returned a body that is not JSON: {exc}", path) from exc
+            rows = payload_row_count(payload)
+            counts["rows"] += rows
+        if from_network:
+            # SpyFu bills per returned row; cached and coalesced responses cost nothing
+            family = endpoint_family(path)
+            credits = rows * CREDITS_PER_ROW.get(family, DEFAULT_CREDITS_PER_ROW)
+            self.metrics.record("request", path, counts={"credits": credits})
+        return payload
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+# Function to get the on-disk response cache shared by every session
+@st.cache_resource
+def get_response_cache():
+    cache = ResponseCache(os.path.join(CACHE_DIR, "spyfu_responses.sqlite"))
+    atexit.register(cache.close)
+    return cache
+
+# Function to get the pipeline metrics shared by every session
+@st.cache_resource
+def get_metrics():
+    return Metrics()
+
+# Largest page requested from the paginated keyword endpoints
+MAX_PAGE_SIZE = 500
+
+# Request slots of the fetch run the current job belongs to, set by iter_fetch on its worker threads
+FETCH_SLOTS = contextvars.ContextVar("FETCH_SLOTS", default=None)
+
+# Function to iterate keyword rows up to a row limit; the first page sizes the rest, which are prefetched
+# in parallel only with request slots the fetch run has free, and fetched in turn otherwise
+def iter_keyword_rows(client, path, params, limit, page_size=MAX_PAGE_SIZE, prefetch=2):
+    page_size = max(1, min(limit, page_size))
+    slots = FETCH_SLOTS.get()
+
+    def fetch_page(start):
+        size = min(page_size, limit - start + 1)
+        page = client.get_json(path, {**params, "startingRow": start, "pageSize": size}) or {}
+        return page.get("results") or [], size, page.get("totalMatchingResults")
+
+    rows, size, total = fetch_page(1)
+    yield from rows
+    if len(rows) < size:
+        return
+    if total is not None:
+        limit = min(limit, total)
+    starts = deque(range(1 + page_size, limit + 1, page_size))
+    if not starts:
+        return
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, prefetch))
+    try:
+        while starts:
+            # This job fetches the next page itself; the pages after it go to free slots
+            for start in list(starts)[1:prefetch + 1]:
+                if start in pending or (slots is not None and not slots.acquire(blocking=False)):
+                    continue
+                pending[start] = executor.submit(fetch_page, start)
+                if slots is not None:
+                    pending[start].add_done_callback(lambda _: slots.release())
+            start = starts.popleft()
+            future = pending.pop(start, None)
+            rows, size, _ = future.result() if future is not None else fetch_page(start)
+            yield from rows
+            if len(rows) < size:
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Function to get the shared SpyFu client, kept alive across Streamlit reruns;
+# call it on the script thread and pass the client to the fetchers, which run on worker threads
+@st.cache_resource
+def get_spyfu_client(api_id, secret_key):
+    client = SpyFuClient(api_id, secret_key, cache=get_response_cache(), metrics=get_metrics())
+    atexit.register(client.close)
+    return client
 
 # Function to get the domain stats for a specific date (for SEO Overview)
-def get_domain_stats(domain, api_id, secret_key, month, year, country_code):
-    credentials = f"{api_id}:{secret_key}"
-    encoded_credentials = base64.b64encode(credentials.encode("utf-8")).decode("utf-8")
-    headers = {'Authorization': f'Basic {encoded_credentials}'}
-
-    conn = http.client.HTTPSConnection("www.spyfu.com")
-    conn.request("GET", f"/apis/domain_stats_api/v2/getDomainStatsForExactDate?month={month}&year={year}&domain={domain}&countryCode={country_code}", headers=headers)
-    res = conn.getresponse()
-    data = res.read()
-    return json.loads(data.decode("utf-8"))
+def get_domain_stats(client, domain, month, year, country_code):
+    return client.get_json(DOMAIN_STATS_PATH, {
+        "month": month,
+        "year": year,
+        "domain": domain,
+        "countryCode": country_code,
+    })
 
 # Function to extract most successful PPC keywords
-def get_most_successful_ppc_keywords(domain, api_id, secret_key, country_code):
-    credentials = f"{api_id}:{secret_key}"
-    encoded_credentials = base64.b64encode(credentials.encode("utf-8")).decode("utf-8")
-    headers = {'Authorization': f'Basic {encoded_credentials}'}
-
-    conn = http.client.HTTPSConnection("www.spyfu.com")
-    conn.request("GET", f"/apis/keyword_api/v2/ppc/getMostSuccessful?query={domain}&excludeDomain=offers.com&sortBy=SearchVolume&sortOrder=Descending&startingRow=1&pageSize=10&countryCode={country_code}&adultFilter=true", headers=headers)
-    res = conn.getresponse()
-    data = res.read()
-    return json.loads(data.decode("utf-8"))
-
-# Function to extract ad history with metrics
-def get_ad_history_with_metrics(domain, api_id, secret_key):
-    credentials = f"{api_id}:{secret_key}"
-    encoded_credentials = base64.b64encode(credentials.encode("utf-8")).decode("utf-8")
-    headers = {'Authorization': f'Basic {encoded_credentials}'}
-    conn = http.client.HTTPSConnection("www.spyfu.com")
-    conn.request("GET", f"/apis/ad_history_api/domain_ad_history_with_metrics?d={domain}&m=200&countryCode=FR", headers=headers)
-    res = conn.getresponse()
-    data = res.read()
-    return json.loads(data.decode("utf-8"))
-
-# Function to display ad history data
-def display_keyword_data(ad_history_data):
-    keyword_list = []
-    
-    # Check if "keywords" exists and is a list
-    if "keywords" in ad_history_data and isinstance(ad_history_data["keywords"], list):
-        for keyword_data in ad_history_data["keywords"]:
-            keyword = keyword_data.get("keyword", "N/A")
-            exact_cpc = keyword_data.get("exact_cpc", "N/A")
-            exact_daily_clicks = keyword_data.get("exact_daily_clicks", "N/A")
-            
-            # Loop through ads associated with each keyword
-            ads = keyword_data.get("ads", [])
-            for ad in ads:
-                ad_title = ad.get("title", "N/A")
-                ad_body = ad.get("body", "N/A")
-                ad_position = ad.get("position", "N/A")
-                search_date_id = ad.get("search_date_id", "N/A")
-
-                # Append all keyword and ad-related info into a list
-                keyword_list.append({
-                    "Keyword": keyword,
-                    "Exact CPC": exact_cpc,
-                    "Exact Daily Clicks": exact_daily_clicks,
-                    "Ad Title": ad_title,
-                    "Ad Body": ad_body,
-                    "Ad Position": ad_position,
-                    "Search Date ID": datetime.strptime(str(search_date_id), "%Y%m%d").date() if search_date_id != "N/A" else "N/A"
-                })
-
-    # Convert the list to a DataFrame and display it
-    if keyword_list:
-        df = pd.DataFrame(keyword_list)
-        st.dataframe(df, use_container_width=True)
-        return df  # Return the DataFrame
-    else:
-        st.write("No keyword data available.")
-        return pd.DataFrame()  # Return an empty DataFrame
-
-# Function to display top ads data
-def display_top_ads(ad_history_data):
-    top_ads_list = []
-    
-    # Check if "top_ads" exists and is a list
-    if "top_ads" in ad_history_data and isinstance(ad_history_data["top_ads"], list):
-        for ad in ad_history_data["top_ads"]:
-            ad_id = ad.get("ad_id", "N/A")
-            title = ad.get("title", "N/A")
-            body = ad.get("body", "N/A")
-            avg_ad_pos = ad.get("avg_ad_pos", "N/A")
-            avg_total_ads = ad.get("avg_total_ads", "N/A")
-            coverage = ad.get("coverage", "N/A")
-
-            # Append all ad-related info into a list
-            top_ads_list.append({
-                "Ad ID": ad_id,
-                "Title": title,
-                "Body": body,
-                "Avg Ad Position": avg_ad_pos,
-                "Avg Total Ads": avg_total_ads,
-                "Coverage": coverage,
-            })
-
-    # Convert the list to a DataFrame and display it
-    if top_ads_list:
-        df = pd.DataFrame(top_ads_list)
+def get_most_successful_ppc_keywords(client, domain, country_code, limit=10):
+    rows = iter_keyword_rows(client, "/apis/keyword_api/v2/ppc/getMostSuccessful", {
+        "query": domain,
+        "excludeDomain": "offers.com",
+        "sortBy": "SearchVolume",
+        "sortOrder": "Descending",
+        "countryCode": country_code,
+        "adultFilter": "true",
+    }, limit)
+    return {"results": collect_rows(rows, KEYWORD_FIELDS)}
+
+# Function to extract ad history with metrics, keeping only the fields the ad tables use
+def get_ad_history_with_metrics(client, domain, country_code):
+    return client.get_json("/apis/ad_history_api/domain_ad_history_with_metrics", {
+        "d": domain,
+        "m": 200,
+        "countryCode": country_code,
+    }, decoder=decode_ad_history)
+
+# Declarative field mappings per table: (column name, source field, dtype)
+TABLE_SCHEMAS = {
+    "ad_history": [
+        ("Keyword", "keyword.keyword", "category"),
+        ("Exact CPC", "keyword.exact_cpc", "float64"),
+        ("Exact Daily Clicks", "keyword.exact_daily_clicks", "float64"),
+        ("Ad Title", "title", "string"),
+        ("Ad Body", "body", "string"),
+        ("Ad Position", "position", "Int64"),
+        ("Search Date ID", "search_date_id", "date"),
+    ],
+    "top_ads": [
+        ("Ad ID", "ad_id", "string"),
+        ("Title", "title", "string"),
+        ("Body", "body", "string"),
+        ("Avg Ad Position", "avg_ad_pos", "float64"),
+        ("Avg Total Ads", "avg_total_ads", "float64"),
+        ("Coverage", "coverage", "float64"),
+    ],
+    "ppc_keywords": [
+        ("Keyword", "keyword", "string"),
+        ("Search Volume", "searchVolume", "Int64"),
+        ("Total Monthly Clicks", "totalMonthlyClicks", "float64"),
+        ("Percent Paid Clicks", "percentPaidClicks", "float64"),
+        ("Broad Monthly Cost", "broadMonthlyCost", "float64"),
+        ("Broad Cost Per Click", "broadCostPerClick", "float64"),
+    ],
+    "valuable_keywords": [
+        ("Keyword", "keyword", "string"),
+        ("Search Volume", "searchVolume", "Int64"),
+        ("SEO Clicks", "seoClicks", "float64"),
+    ],
+    "newly_ranked_keywords": [
+        ("Keyword", "keyword", "string"),
+        ("Search Volume", "searchVolume", "Int64"),
+        ("Rank", "rank", "Int64"),
+        ("SEO Clicks", "seoClicks", "float64"),
+    ],
+    "gained_clicks_keywords": [
+        ("Keyword", "keyword", "string"),
+        ("Rank", "rank", "Int64"),
+        ("SEO Clicks", "seoClicks", "float64"),
+    ],
+    "keyword_gap": [
+        ("Keyword", "keyword", "string"),
+        ("Rank", "rank", "float64"),
+        ("Search Volume", "searchVolume", "float64"),
+        ("CPC", "broadCostPerClick", "float64"),
+    ],
+}
+
+# Fields of the ad history payload that the ad history and top ads tables read
+AD_KEYWORD_FIELDS = tuple(source.split(".", 1)[1] for _, source, _ in TABLE_SCHEMAS["ad_history"] if source.startswith("keyword."))
+AD_FIELDS = tuple(source for _, source, _ in TABLE_SCHEMAS["ad_history"] if not source.startswith("keyword."))
+TOP_AD_FIELDS = tuple(source for _, source, _ in TABLE_SCHEMAS["top_ads"])
+
+# Function to keep only the declared fields of each record
+def _prune_records(records, fields):
+    return [{field: record.get(field) for field in fields} for record in records or [] if isinstance(record, dict)]
+
+# Function to decode an ad history payload and drop every field the ad tables do not read
+def prune_ad_history(payload):
+    if not isinstance(payload, dict):
+        return payload
+    keywords = [{**keyword, "ads": _prune_records(keyword.get("ads"), AD_FIELDS)}
+                for keyword in _prune_records(payload.get("keywords"), AD_KEYWORD_FIELDS + ("ads",))]
+    return {"keywords": keywords, "top_ads": _prune_records(payload.get("top_ads"), TOP_AD_FIELDS)}
+
+if HAS_MSGSPEC:
+    from typing import Any, Optional
+
+    # Python types of the numeric schema dtypes; text and dates stay as sent
+    MSGSPEC_TYPES = {"float64": Optional[float], "Int64": Optional[int]}
+
+    # Function to declare a struct holding only the given schema fields
+    def _schema_struct(name, fields, extra=()):
+        return msgspec.defstruct(name, [(source, MSGSPEC_TYPES.get(dtype, Any), None) for source, dtype in fields] + list(extra))
+
+    _Ad = _schema_struct("Ad", [(source, dtype) for _, source, dtype in TABLE_SCHEMAS["ad_history"]
+                                if not source.startswith("keyword.")])
+    _AdKeyword = _schema_struct("AdKeyword", [(source.split(".", 1)[1], dtype) for _, source, dtype in TABLE_SCHEMAS["ad_history"]
+                                              if source.startswith("keyword.")], [("ads", Optional[list[_Ad]], None)])
+    _TopAd = _schema_struct("TopAd", [(source, dtype) for _, source, dtype in TABLE_SCHEMAS["top_ads"]])
+    _AdHistory = msgspec.defstruct("AdHistory", [("keywords", Optional[list[_AdKeyword]], None),
+                                                 ("top_ads", Optional[list[_TopAd]], None)])
+    # Lax mode accepts numbers sent as strings; undeclared fields are skipped without being built
+    AD_HISTORY_DECODER = msgspec.json.Decoder(_AdHistory, strict=False)
+
+# Function to decode an ad history body into only the fields the ad tables read,
+# typed structs with msgspec, otherwise a full decode pruned right away
+def decode_ad_history(data):
+    if HAS_MSGSPEC:
+        try:
+            return msgspec.to_builtins(AD_HISTORY_DECODER.decode(data))
+        except msgspec.ValidationError:
+            # A field of an unexpected type: fall back to the untyped decode
+            pass
+    return prune_ad_history(decode_json(data))
+
+# Function to cast a raw column to its schema dtype in one vectorized pass
+def _cast_column(values, dtype):
+    if dtype == "date":
+        date_ids = pd.to_numeric(values, errors="coerce").astype("Int64").astype("string")
+        return pd.to_datetime(date_ids, format="%Y%m%d", errors="coerce")
+    if dtype in ("category", "string"):
+        return values.astype(dtype)
+    numeric = pd.to_numeric(values, errors="coerce")
+    try:
+        return numeric.astype(dtype)
+    except TypeError:
+        return numeric
+
+# Function to turn a raw field frame into typed columns following a table schema
+def _apply_schema(raw_df, schema):
+    columns = {}
+    for name, field, dtype in schema:
+        values = raw_df[field] if field in raw_df else pd.Series([None] * len(raw_df), index=raw_df.index, dtype="object")
+        columns[name] = _cast_column(values, dtype)
+    return pd.DataFrame(columns).reset_index(drop=True)
+
+# Function to build a typed DataFrame from row dicts, or from a frame of raw fields collected while streaming
+def normalize_records(rows, schema):
+    if isinstance(rows, pd.DataFrame):
+        return _apply_schema(rows, schema)
+    fields = [field for _, field, _ in schema]
+    return _apply_schema(pd.DataFrame.from_records(rows, columns=fields), schema)
+
+# Raw fields read by any keyword table, collected from the paginated keyword endpoints
+KEYWORD_FIELDS = list(dict.fromkeys(
+    field for table in ("ppc_keywords", "valuable_keywords", "newly_ranked_keywords", "gained_clicks_keywords", "keyword_gap")
+    for _, field, _ in TABLE_SCHEMAS[table]))
+
+# Function to collect the given fields of streamed row dicts column by column; each row is dropped once read
+def collect_rows(rows, fields):
+    columns = {field: [] for field in fields}
+    for row in rows:
+        for field, values in columns.items():
+            values.append(row.get(field))
+    return pd.DataFrame(columns)
+
+# Function to pull the rows of a keyword payload: a list of row dicts, or a frame of collected raw fields
+def _payload_rows(data, key="results"):
+    if isinstance(data, dict) and isinstance(data.get(key), (list, pd.DataFrame)):
+        return data[key]
+    return []
+
+# Function to build the ad history table, one row per (keyword, ad)
+def build_ad_history_df(ad_history_data):
+    schema = TABLE_SCHEMAS["ad_history"]
+    keywords = [k for k in _payload_rows(ad_history_data, "keywords") if k.get("ads")]
+    if not keywords:
+        return normalize_records([], schema)
+    raw_df = pd.json_normalize(keywords, record_path="ads", meta=["keyword", "exact_cpc", "exact_daily_clicks"],
+                               meta_prefix="keyword.", errors="ignore")
+    return _apply_schema(raw_df, schema)
+
+# Function to build the top ads table
+def build_top_ads_df(ad_history_data):
+    return normalize_records(_payload_rows(ad_history_data, "top_ads"), TABLE_SCHEMAS["top_ads"])
+
+# Function to build the PPC keywords table
+def build_ppc_keywords_df(ppc_data):
+    return normalize_records(_payload_rows(ppc_data), TABLE_SCHEMAS["ppc_keywords"])
+
+# Function to build the most valuable keywords table
+def build_keywords_df(keywords_data):
+    return normalize_records(_payload_rows(keywords_data), TABLE_SCHEMAS["valuable_keywords"])
+
+# Function to build the newly ranked keywords table
+def build_newly_ranked_keywords_df(new_keywords_data):
+    return normalize_records(_payload_rows(new_keywords_data), TABLE_SCHEMAS["newly_ranked_keywords"])
+
+# Function to build the gained clicks keywords table
+def build_gained_clicks_keywords_df(gained_keywords_data):
+    return normalize_records(_payload_rows(gained_keywords_data), TABLE_SCHEMAS["gained_clicks_keywords"])
+
+# Function to build the per-domain keyword table the gap engine indexes
+def build_keyword_gap_df(keywords_data):
+    return normalize_records(_payload_rows(keywords_data), TABLE_SCHEMAS["keyword_gap"])
+
+# Function to index every domain's keywords as one long frame with categorical keyword IDs
+def build_keyword_index(frames_by_domain):
+    parts = [df.assign(Domain=d) for d, df in frames_by_domain.items() if df is not None and not df.empty]
+    if not parts:
+        # Same dtypes as a populated index, so the gap engine runs unchanged on no keywords
+        return pd.DataFrame({
+            "Domain": pd.Categorical([]),
+            "keyword_id": pd.Series(dtype="int64"),
+            "Keyword": pd.Series(dtype="string"),
+            "Rank": pd.Series(dtype="float64"),
+            "Search Volume": pd.Series(dtype="float64"),
+            "CPC": pd.Series(dtype="float64"),
+        })
+    index = pd.concat(parts, ignore_index=True)
+    index["Keyword"] = index["Keyword"].str.strip().str.lower()
+    index = index.dropna(subset=["Keyword"])
+    index["keyword_id"], _ = pd.factorize(index["Keyword"])
+    index["Domain"] = index["Domain"].astype("category")
+    # One row per (domain, keyword), keeping the domain's best rank
+    return index.sort_values("Rank", na_position="last").drop_duplicates(["Domain", "keyword_id"]).reset_index(drop=True)
+
+# Function to compute shared, competitor-unique and outranked keywords with vectorized set operations
+def keyword_gap(frames_by_domain, main_domain):
+    index = build_keyword_index(frames_by_domain)
+    index["Opportunity"] = index["Search Volume"].fillna(0) * index["CPC"].fillna(0)
+    is_main = (index["Domain"] == main_domain).to_numpy()
+    main_rows = index[is_main].set_index("keyword_id")
+    competitors = index[~is_main].copy()
+    competitors["Domain"] = competitors["Domain"].cat.remove_unused_categories()
+    competitors["Main Rank"] = competitors["keyword_id"].map(main_rows["Rank"])
+    in_main = competitors["keyword_id"].isin(main_rows.index)
+    domains_per_keyword = index.groupby("keyword_id")["Domain"].size()
+    unique = competitors[~in_main & competitors["keyword_id"].map(domains_per_keyword).eq(1)]
+    outranked = competitors[in_main & (competitors["Rank"] < competitors["Main Rank"])]
+
+    shared = (competitors[in_main]
+              .groupby("keyword_id")
+              .agg(Keyword=("Keyword", "first"), Competitors=("Domain", "size"),
+                   **{"Search Volume": ("Search Volume", "max"), "CPC": ("CPC", "max"), "Opportunity": ("Opportunity", "max")})
+              .assign(**{"Main Rank": lambda df: df.index.map(main_rows["Rank"])})
+              .sort_values("Opportunity", ascending=False)
+              .reset_index(drop=True))
+
+    def per_competitor(rows, prefix):
+        grouped = rows.groupby("Domain", observed=False)
+        return pd.DataFrame({
+            f"{prefix} Keywords": grouped.size(),
+            f"{prefix} Search Volume": grouped["Search Volume"].sum(),
+            f"{prefix} CPC Opportunity": grouped["Opportunity"].sum(),
+        })
+
+    summary = pd.concat([
+        per_competitor(competitors[in_main], "Shared"),
+        per_competitor(unique, "Unique"),
+        per_competitor(outranked, "Outranking"),
+    ], axis=1).fillna(0).rename_axis("Competitor").reset_index()
+
+    columns = ["Keyword", "Domain", "Rank", "Main Rank", "Search Volume", "CPC", "Opportunity"]
+    return {
+        "summary": summary,
+        "shared": shared,
+        "unique": unique[columns].drop(columns="Main Rank").sort_values("Opportunity", ascending=False).reset_index(drop=True),
+        "outranked": outranked[columns].sort_values("Opportunity", ascending=False).reset_index(drop=True),
+    }
+
+# Function to render a built table, or a message when it is empty; the key names the table's pager widgets
+def render_dataframe(df, empty_message, key):
+    if df.empty:
+        st.write(empty_message)
+    elif len(df) <= TABLE_PAGE_SIZES[0]:
         st.dataframe(df, use_container_width=True)
-        return df  # Return the DataFrame
     else:
-        st.write("No top ads data available.")
-        return pd.DataFrame()  # Return an empty DataFrame
-
-# Function to display PPC keyword data in a table
-def display_ppc_keywords(ppc_data):
-    if ppc_data and "results" in ppc_data:
-        ppc_keywords_list = []
-        for keyword in ppc_data["results"]:
-            ppc_keywords_list.append({
-                "Keyword": keyword.get("keyword"),
-                "Search Volume": keyword.get("searchVolume"),
-                "Total Monthly Clicks": keyword.get("totalMonthlyClicks"),
-                "Percent Paid Clicks": keyword.get("percentPaidClicks"),
-                "Broad Monthly Cost": keyword.get("broadMonthlyCost"),
-                "Broad Cost Per Click": keyword.get("broadCostPerClick")
-            })
-        
-        df = pd.DataFrame(ppc_keywords_list)
-        st.dataframe(df, use_container_width=True)  # Display a sortable dataframe with full width
-        return df
-    else:
-        st.write("No PPC keyword data available.")
-        return pd.DataFrame()  # Return an empty DataFrame
+        render_table_page(df, key)
+    return df
+
+# Rows per page offered by the table pager; tables up to the smallest size are sent whole
+TABLE_PAGE_SIZES = [50, 100, 250, 1000]
+
+# Sort orders, filter text and summary rows of a table, computed once per frame on the server
+class TableIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._orders = {}
+        self._search_text = None
+        self._masks = OrderedDict()
+        self._summary = None
+
+    # Row positions sorted by a column, missing values last in both directions
+    def order(self, df, column, descending):
+        with self._lock:
+            if (column, descending) not in self._orders:
+                if (column, False) not in self._orders:
+                    values = df[column].reset_index(drop=True)
+                    present = values.notna().to_numpy()
+                    try:
+                        ascending = values.sort_values(kind="stable", na_position="last").index.to_numpy()
+                    except TypeError:
+                        # Mixed types in an object column sort as text, with missing values kept last
+                        ascending = np.concatenate([values[present].astype(str).sort_values(kind="stable").index.to_numpy(),
+                                                    np.flatnonzero(~present)])
+                    self._orders[(column, False)] = ascending
+                    self._orders[(column, "valid")] = int(present.sum())
+                ascending = self._orders[(column, False)]
+                valid = self._orders[(column, "valid")]
+                self._orders[(column, True)] = np.concatenate([ascending[:valid][::-1], ascending[valid:]])
+            return self._orders[(column, descending)]
+
+    # Boolean mask of the rows whose text columns contain the query, case-insensitively
+    def matches(self, df, query):
+        query = query.lower()
+        with self._lock:
+            if self._search_text is None:
+                columns = [c for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])] or list(df.columns)
+                text = df[columns[0]].astype(str).str.lower().reset_index(drop=True)
+                for column in columns[1:]:
+                    text = text + "\x1f" + df[column].astype(str).str.lower().reset_index(drop=True)
+                self._search_text = text
+            if query not in self._masks:
+                self._masks[query] = self._search_text.str.contains(query, regex=False).to_numpy()
+                if len(self._masks) > 8:
+                    self._masks.popitem(last=False)
+            return self._masks[query]
+
+    # Total, mean, min and max of the numeric columns over all rows, or over the given row positions
+    def summary(self, df, positions=None):
+        if positions is None and self._summary is not None:
+            return self._summary
+        numeric = df[[c for c in df.columns if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]]
+        if numeric.columns.empty:
+            return pd.DataFrame()
+        if positions is not None:
+            numeric = numeric.iloc[positions]
+        summary = numeric.agg(["sum", "mean", "min", "max"]).set_axis(["Total", "Mean", "Min", "Max"])
+        if positions is None:
+            self._summary = summary
+        return summary
+
+_TABLE_INDEXES = {}
+_TABLE_INDEXES_LOCK = threading.Lock()
+
+# Function to get the table index of a frame, dropped once the frame is garbage collected
+def table_index(df):
+    key = id(df)
+    with _TABLE_INDEXES_LOCK:
+        entry = _TABLE_INDEXES.get(key)
+        if entry is not None and entry[0]() is df:
+            return entry[1]
+
+        def forget(ref, key=key):
+            with _TABLE_INDEXES_LOCK:
+                if _TABLE_INDEXES.get(key, (None,))[0] is ref:
+                    del _TABLE_INDEXES[key]
+
+        index = TableIndex()
+        _TABLE_INDEXES[key] = (weakref.ref(df, forget), index)
+        return index
+
+# Function to render one page of a large table, sorted and filtered on the server; only that page is sent
+def render_table_page(df, key):
+    index = table_index(df)
+    col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+    query = col1.text_input("Filter", key=f"{key}_filter", placeholder="Filter rows by text")
+    sort_column = col2.selectbox("Sort by", [None] + list(df.columns), key=f"{key}_sort",
+                                 format_func=lambda c: "Original order" if c is None else str(c))
+    descending = col3.selectbox("Order", ["Ascending", "Descending"], key=f"{key}_order") == "Descending"
+    page_rows = col4.selectbox("Rows per page", TABLE_PAGE_SIZES, key=f"{key}_page_rows")
+
+    positions = None if sort_column is None else index.order(df, sort_column, descending)
+    if query:
+        mask = index.matches(df, query)
+        positions = np.flatnonzero(mask) if positions is None else positions[mask[positions]]
+    total = len(df) if positions is None else len(positions)
+
+    if st.toggle("Summary rows", value=True, key=f"{key}_summary"):
+        summary = index.summary(df, positions if query else None)
+        if not summary.empty:
+            st.dataframe(summary, use_container_width=True)
+
+    pages = max(1, -(-total // page_rows))
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+    start = (st.session_state.get(page_key, 1) - 1) * page_rows
+    page_positions = np.arange(start, min(start + page_rows, total)) if positions is None else positions[start:start + page_rows]
+    st.dataframe(df.iloc[page_positions], use_container_width=True)
+
+    col1, col2 = st.columns([3, 1])
+    filtered = f" (filtered from {len(df):,})" if query else ""
+    col1.caption(f"Rows {min(start + 1, total):,}-{min(start + page_rows, total):,} of {total:,}{filtered}")
+    col2.number_input("Page", min_value=1, max_value=pages, step=1, key=page_key)
 
 # Function to extract valuable keywords from SpyFu
-def get_valuable_keywords(domain, api_id, secret_key, country_code):
-    credentials = f"{api_id}:{secret_key}"
-    encoded_credentials = base64.b64encode(credentials.encode("utf-8")).decode("utf-8")
-    headers = {'Authorization': f'Basic {encoded_credentials}'}
-
-    conn = http.client.HTTPSConnection("www.spyfu.com")
-    conn.request("GET", f"/apis/serp_api/v2/seo/getMostValuableKeywords?query={domain}&sortBy=seoClicks&sortOrder=Descending&startingRow=1&pageSize=11&countryCode={country_code}", headers=headers)
-    res = conn.getresponse()
-    data = res.read()
-    return json.loads(data.decode("utf-8"))
-
-# Function to display valuable keywords
-def display_keywords(keywords_data):
-    if keywords_data and "results" in keywords_data:
-        keywords_list = []
-        for keyword in keywords_data["results"]:
-            keywords_list.append({
-                "Keyword": keyword.get("keyword"),
-                "Search Volume": keyword.get("searchVolume"),
-                "SEO Clicks": keyword.get("seoClicks")
-            })
-        
-        df = pd.DataFrame(keywords_list)
-        st.dataframe(df, use_container_width=True)  # Display a sortable dataframe with full width
-        return df
-    else:
-        st.write("No valuable keyword data available.")
-        return pd.DataFrame()
+def get_valuable_keywords(client, domain, country_code, limit=11):
+    rows = iter_keyword_rows(client, "/apis/serp_api/v2/seo/getMostValuableKeywords", {
+        "query": domain,
+        "sortBy": "seoClicks",
+        "sortOrder": "Descending",
+        "countryCode": country_code,
+    }, limit)
+    return {"results": collect_rows(rows, KEYWORD_FIELDS)}
 
 # Function to extract newly ranked keywords from SpyFu
-def get_newly_ranked_keywords(domain, api_id, secret_key, country_code):
-    credentials = f"{api_id}:{secret_key}"
-    encoded_credentials = base64.b64encode(credentials.encode("utf-8")).decode("utf-8")
-    headers = {'Authorization': f'Basic {encoded_credentials}'}
-
-    conn = http.client.HTTPSConnection("www.spyfu.com")
-    conn.request("GET", f"/apis/serp_api/v2/seo/getNewlyRankedKeywords?query={domain}&sortBy=SeoClicks&sortOrder=Descending&startingRow=1&pageSize=10&countryCode={country_code}", headers=headers)
-    res = conn.getresponse()
-    data = res.read()
-    return json.loads(data.decode("utf-8"))
-
-# Function to display newly ranked keywords
-def display_newly_ranked_keywords(new_keywords_data):
-    if new_keywords_data and "results" in new_keywords_data:
-        newly_ranked_list = []
-        for keyword in new_keywords_data["results"]:
-            newly_ranked_list.append({
-                "Keyword": keyword.get("keyword"),
-                "Search Volume": keyword.get("searchVolume"),
-                "Rank": keyword.get("rank"),
-                "SEO Clicks": keyword.get("seoClicks")
-            })
-        
-        df = pd.DataFrame(newly_ranked_list)
-        st.dataframe(df, use_container_width=True)
-        return df
-    else:
-        st.write("No newly ranked keyword data available.")
-        return pd.DataFrame()
+def get_newly_ranked_keywords(client, domain, country_code, limit=10):
+    rows = iter_keyword_rows(client, "/apis/serp_api/v2/seo/getNewlyRankedKeywords", {
+        "query": domain,
+        "sortBy": "SeoClicks",
+        "sortOrder": "Descending",
+        "countryCode": country_code,
+    }, limit)
+    return {"results": collect_rows(rows, KEYWORD_FIELDS)}
 
 # Function to extract gained clicks keywords from SpyFu
-def get_gained_clicks_keywords(domain, api_id, secret_key, country_code):
-    credentials = f"{api_id}:{secret_key}"
-    encoded_credentials = base64.b64encode(credentials.encode("utf-8")).decode("utf-8")
-    headers = {'Authorization': f'Basic {encoded_credentials}'}
-
-    conn = http.client.HTTPSConnection("www.spyfu.com")
-    conn.request("GET", f"/apis/serp_api/v2/seo/getGainedClicksKeywords?query={domain}&sortBy=SearchVolume&sortOrder=Descending&startingRow=1&pageSize=5&countryCode={country_code}", headers=headers)
-    res = conn.getresponse()
-    data = res.read()
-    return json.loads(data.decode("utf-8"))
-
-# Function to display gained clicks keywords
-def display_gained_clicks_keywords(gained_keywords_data):
-    if gained_keywords_data and "results" in gained_keywords_data:
-        gained_clicks_list = []
-        for keyword in gained_keywords_data["results"]:
-            gained_clicks_list.append({
-                "Keyword": keyword.get("keyword"),
-                "Rank": keyword.get("rank"),
-                "SEO Clicks": keyword.get("seoClicks")
-            })
-        
-        df = pd.DataFrame(gained_clicks_list)
-        st.dataframe(df, use_container_width=True)
-        return df
-    else:
-        st.write("No gained clicks keyword data available.")
-        return pd.DataFrame()
+def get_gained_clicks_keywords(client, domain, country_code, limit=5):
+    rows = iter_keyword_rows(client, "/apis/serp_api/v2/seo/getGainedClicksKeywords", {
+        "query": domain,
+        "sortBy": "SearchVolume",
+        "sortOrder": "Descending",
+        "countryCode": country_code,
+    }, limit)
+    return {"results": collect_rows(rows, KEYWORD_FIELDS)}
 
 # Function to get the SEA stats for a specific date (Paid Keywords, PPC Clicks, PPC Budget)
-def get_sea_stats(domain, api_id, secret_key, month, year, country_code):
-    credentials = f"{api_id}:{secret_key}"
-    encoded_credentials = base64.b64encode(credentials.encode("utf-8")).decode("utf-8")
-    headers = {'Authorization': f'Basic {encoded_credentials}'}
-
-    conn = http.client.HTTPSConnection("www.spyfu.com")
-    conn.request("GET", f"/apis/domain_stats_api/v2/getDomainStatsForExactDate?month={month}&year={year}&domain={domain}&countryCode={country_code}", headers=headers)
-    res = conn.getresponse()
-    data = res.read()
-    return json.loads(data.decode("utf-8"))
+# Both tabs read the same domain-stats payload, so this shares get_domain_stats' cached request
+def get_sea_stats(client, domain, month, year, country_code):
+    return get_domain_stats(client, domain, month, year, country_code)
+
+# Function to pick the stats record out of a domain-stats payload
+def domain_stats_record(stats_data):
+    if stats_data and "results" in stats_data and stats_data["results"]:
+        return stats_data["results"][0]
+    return None
 
 # Function to display KPIs for SEO Overview
 def display_kpis(stats, domain, backlinks_data=None):
@@ -254,9 +1044,8 @@ def display_kpis(stats, domain, backlinks_data=None):
         col4.metric(f"Total Backlinks ({domain})", "N/A")
 
 # Function to display SEA KPIs (Paid Keywords, PPC Clicks, PPC Budget)
-def display_sea_kpis(sea_data, domain):
-    if sea_data and "results" in sea_data and sea_data["results"]:
-        stats = sea_data["results"][0]
+def display_sea_kpis(stats, domain):
+    if stats is not None:
         col1, col2, col3 = st.columns(3)
         col1.metric(f"Paid Keywords ({domain})", stats["totalAdsPurchased"])
         col2.metric(f"Est. Monthly PPC Clicks ({domain})", round(stats["monthlyPaidClicks"],2))
@@ -264,6 +1053,83 @@ def display_sea_kpis(sea_data, domain):
     else:
         st.write(f"No SEA data available for {domain}")
 
+# File types accepted by the upload widgets
+UPLOAD_TYPES = ["xlsx", "xls", "csv", "parquet"]
+
+# Column name fragments the backlink analytics use; other Backlinks columns are not loaded.
+# Other uploads are shown and exported in full, so every one of their columns is kept
+UPLOAD_COLUMN_TOKENS = {
+    "Backlinks": ("url", "anchor", "follow", "ugc", "sponsored", "domain", "rating", "ascore", "title",
+                  "type", "traffic", "seen", "lost", "new"),
+}
+
+# Function to shrink a parsed sheet: low-cardinality text becomes categorical, numbers are downcast
+def compact_dtypes(df):
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_integer_dtype(values) and not pd.api.types.is_extension_array_dtype(values):
+            df[column] = pd.to_numeric(values, downcast="integer")
+        elif pd.api.types.is_float_dtype(values):
+            df[column] = pd.to_numeric(values, downcast="float")
+        elif values.dtype == object and len(values) and values.nunique(dropna=True) <= len(values) // 2:
+            df[column] = values.astype("category")
+    return df
+
+# Function to read every sheet of an uploaded file, keeping only the wanted columns when it has any
+def _read_upload_sheets(content, file_name, usecols):
+    extension = file_name.rsplit(".", 1)[-1].lower()
+    stem = file_name.rsplit(".", 1)[0]
+    if extension == "csv":
+        return {stem: pd.read_csv(BytesIO(content), usecols=usecols)}
+    if extension == "parquet":
+        columns = None
+        if usecols is not None:
+            import pyarrow.parquet as pq
+            names = pq.read_schema(BytesIO(content)).names
+            columns = [names[i] for i in usecols] if isinstance(usecols, list) else [c for c in names if usecols(c)]
+        return {stem: pd.read_parquet(BytesIO(content), columns=columns)}
+    engine = "calamine" if HAS_CALAMINE else None
+    return pd.read_excel(BytesIO(content), sheet_name=None, usecols=usecols, engine=engine)
+
+# Function to parse an upload once per content hash, shared across reruns without copying the frames;
+# returns the sheets and the names of the columns that were not loaded
+@st.cache_resource(max_entries=16, show_spinner="Parsing upload...")
+def parse_upload(content_hash, file_name, file_type, _content):
+    if file_type == "Competitors":
+        # Competitor lists only need their first column
+        return {name: compact_dtypes(df) for name, df in _read_upload_sheets(_content, file_name, [0]).items()}, []
+    tokens = UPLOAD_COLUMN_TOKENS.get(file_type)
+    if tokens is None:
+        return {name: compact_dtypes(df) for name, df in _read_upload_sheets(_content, file_name, None).items()}, []
+    dropped = {}
+
+    def wanted(column):
+        keep = any(token in str(column).lower() for token in tokens)
+        if not keep:
+            dropped[str(column)] = None
+        return keep
+
+    sheets = _read_upload_sheets(_content, file_name, wanted)
+    if any(df.columns.empty for df in sheets.values()):
+        # Unknown export layout: fall back to loading every column of the file
+        full_sheets = _read_upload_sheets(_content, file_name, None)
+        sheets = {name: df if not df.columns.empty else full_sheets[name] for name, df in sheets.items()}
+    loaded = {str(column) for df in sheets.values() for column in df.columns}
+    return {name: compact_dtypes(df) for name, df in sheets.items()}, [c for c in dropped if c not in loaded]
+
+# Function to hash an uploaded file once per upload, not on every rerun
+def upload_content_hash(uploaded_file):
+    hashes = st.session_state.setdefault("upload_hashes", {})
+    file_id = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+    if file_id not in hashes:
+        hashes[file_id] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    return hashes[file_id]
+
+# Function to load an uploaded file as a dict of sheets through the parse cache
+def load_upload(uploaded_file, file_type):
+    sheets, _ = parse_upload(upload_content_hash(uploaded_file), uploaded_file.name, file_type, uploaded_file.getvalue())
+    return sheets
+
 # Function to handle competitors input from Excel or manual input
 def get_competitor_domains():
     competitor_option = st.radio("How would you like to provide competitor domains?", ('Upload Excel File', 'Enter Manually'))
@@ -271,10 +1137,10 @@ def get_competitor_domains():
     competitor_domains = []
 
     if competitor_option == 'Upload Excel File':
-        uploaded_file = st.file_uploader("Upload Competitor Domains Excel File", type=["xlsx", "xls"], key="competitor_file")
+        uploaded_file = st.file_uploader("Upload Competitor Domains Excel File", type=UPLOAD_TYPES, key="competitor_file")
         if uploaded_file is not None:
-            df = pd.read_excel(uploaded_file)
-            competitor_domains = df.iloc[:, 0].tolist()  # Assuming domains are in the first column
+            df = next(iter(load_upload(uploaded_file, "Competitors").values()))
+            competitor_domains = df.iloc[:, 0].dropna().astype(str).tolist()  # Assuming domains are in the first column
 
     elif competitor_option == 'Enter Manually':
         manual_input = st.text_area("Enter competitor domains (comma-separated)", "")
@@ -283,58 +1149,1008 @@ def get_competitor_domains():
 
     return competitor_domains
 
+# Function to normalize a domain, URL or sheet name to a bare lowercase host
+def normalize_domain(value):
+    value = str(value).strip().lower()
+    if "://" not in value:
+        value = "//" + value
+    host = urlsplit(value).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+# Number of matching passes, from exact host to bare first label
+DOMAIN_KEY_PASSES = 3
+
+# Function to list the key a domain is looked up by in each matching pass:
+# exact host, host without punctuation, then its first label (only matched against sheet names without a TLD)
+def domain_keys(value):
+    host = normalize_domain(value)
+    if not host:
+        return [None] * DOMAIN_KEY_PASSES
+    return [host, re.sub(r"[^a-z0-9]", "", host), host.split(".")[0] if "." in host else None]
+
+# Function to list the key a sheet is indexed under in each matching pass; a bare name like "amazon"
+# never matches a full host, and a host like "amazon.de" never matches by its first label alone
+def sheet_keys(sheet_host):
+    compact = re.sub(r"[^a-z0-9]", "", sheet_host)
+    if "." in sheet_host:
+        return [sheet_host, compact, None]
+    return [None, compact, compact]
+
+# Columns that hold the domain a sheet is about
+SHEET_DOMAIN_COLUMNS = ("target url", "target", "domain", "url", "page url")
+
+# Function to find the domain a sheet is about: its name when it looks like a domain, else a domain column
+def sheet_domain(sheet_name, df):
+    if "." in normalize_domain(sheet_name):
+        return normalize_domain(sheet_name)
+    columns = {str(column).strip().lower(): column for column in df.columns}
+    for candidate in SHEET_DOMAIN_COLUMNS:
+        if candidate in columns:
+            values = df[columns[candidate]].dropna()
+            if len(values) and "." in normalize_domain(values.iloc[0]):
+                return normalize_domain(values.iloc[0])
+    return normalize_domain(sheet_name)
+
+# Uploaded sheets indexed by the normalized domain keys they belong to
+class SheetIndex:
+    def __init__(self, sheets, content_hash=None, dropped_columns=()):
+        self.sheets = sheets
+        self.content_hash = content_hash
+        self.dropped_columns = list(dropped_columns)
+        self.sheet_domains = {name: sheet_domain(name, df) for name, df in sheets.items()}
+        self._analytics = {}
+        self._lock = threading.Lock()
+        self._by_key = [{} for _ in range(DOMAIN_KEY_PASSES)]
+        for name, sheet_host in self.sheet_domains.items():
+            for by_key, key in zip(self._by_key, sheet_keys(sheet_host)):
+                if key:
+                    by_key.setdefault(key, name)
+
+    def __len__(self):
+        return len(self.sheets)
+
+    # Backlink analytics of a sheet, computed once per upload
+    def analytics(self, name):
+        with self._lock:
+            if name not in self._analytics:
+                self._analytics[name] = compute_backlink_analytics(self.sheets[name])
+            return self._analytics[name]
+
+    # Map each domain to its sheet, returning the matches, the unmatched sheet names and whether order was used
+    def match(self, domains):
+        matches = {}
+        used = set()
+        by_position = False
+        # Each pass runs over every domain before a looser one, so an exact host is never taken by a near match
+        for pass_index, by_key in enumerate(self._by_key):
+            for d in domains:
+                key = domain_keys(d)[pass_index]
+                name = by_key.get(key) if key and d not in matches else None
+                if name is not None and name not in used:
+                    matches[d] = name
+                    used.add(name)
+        if not matches and not any("." in host for host in self.sheet_domains.values()):
+            # Nothing looks like a domain (Sheet1, Sheet2...): keep the workbook order
+            matches = dict(zip(domains, self.sheets))
+            used = set(matches.values())
+            by_position = bool(matches)
+        return matches, [name for name in self.sheets if name not in used], by_position
+
+# Function to parse an upload and index its sheets by domain, once per content hash
+@st.cache_resource(max_entries=16)
+def index_upload(content_hash, file_name, file_type, _content):
+    sheets, dropped_columns = parse_upload(content_hash, file_name, file_type, _content)
+    return SheetIndex(sheets, content_hash, dropped_columns)
+
 # Function to handle Excel file upload
 def handle_excel_upload(file_type):
-    uploaded_file = st.file_uploader(f"Upload {file_type} Excel file", type=["xlsx", "xls"], key=f"{file_type}_file")
+    uploaded_file = st.file_uploader(f"Upload {file_type} file (Excel, CSV or Parquet)", type=UPLOAD_TYPES, key=f"{file_type}_file")
     if uploaded_file is not None:
-        df_dict = pd.read_excel(uploaded_file, sheet_name=None)
-        return df_dict
+        sheet_index = index_upload(upload_content_hash(uploaded_file), uploaded_file.name, file_type, uploaded_file.getvalue())
+        if sheet_index.dropped_columns:
+            st.caption(f"Columns not used by the {file_type.lower()} analytics and left out of the table and export: "
+                       f"{', '.join(sheet_index.dropped_columns)}")
+        return sheet_index
+    return None
+
+# Function to match uploaded sheets to the run's domains (domain -> sheet name) and report the sheets that matched none
+def match_upload_sheets(sheet_index, domains, file_type):
+    if sheet_index is None:
+        return {}
+    matches, unmatched, by_position = sheet_index.match(domains)
+    if by_position:
+        st.info(f"No {file_type} sheet names a domain, so sheets are matched by workbook order.")
+    if unmatched:
+        st.warning(f"{file_type} sheets not matched to any domain: {', '.join(map(str, unmatched))}")
+    return matches
+
+# Column names used by Ahrefs / Semrush backlink exports
+BACKLINK_DOMAIN_COLUMNS = ("referring domain", "source domain")
+BACKLINK_URL_COLUMNS = ("referring page url", "source url", "source_url", "referring url", "url from")
+BACKLINK_ANCHOR_COLUMNS = ("anchor", "anchor text")
+BACKLINK_NOFOLLOW_COLUMNS = ("nofollow",)
+BACKLINK_TYPE_COLUMNS = ("link type", "type")
+
+# Function to find the first column of a frame matching one of the candidate names
+def _find_column(df, candidates):
+    columns = {str(column).strip().lower(): column for column in df.columns}
+    return next((columns[c] for c in candidates if c in columns), None)
+
+# Function to get the normalized referring host of every backlink
+def referring_hosts(df):
+    column = _find_column(df, BACKLINK_DOMAIN_COLUMNS)
+    if column is not None:
+        hosts = df[column].astype("string").str.strip().str.lower()
+    else:
+        column = _find_column(df, BACKLINK_URL_COLUMNS)
+        if column is None:
+            return None
+        hosts = df[column].astype("string").str.extract(r"^(?:[a-z][a-z0-9+.-]*://)?([^/:?#\s]+)", flags=re.I, expand=False).str.lower()
+    return hosts.str.replace(r"^www\.", "", regex=True)
+
+# Function to get whether every backlink is nofollow, when the export says so
+def nofollow_flags(df):
+    column = _find_column(df, BACKLINK_NOFOLLOW_COLUMNS)
+    if column is not None:
+        return df[column].astype("string").str.strip().str.lower().isin(["true", "1", "yes", "nofollow"])
+    column = _find_column(df, BACKLINK_TYPE_COLUMNS)
+    if column is not None:
+        return df[column].astype("string").str.lower().str.contains("nofollow", na=False)
     return None
 
+# Function to compute the backlink aggregates of one sheet in vectorized passes
+def compute_backlink_analytics(df, top_n=20):
+    analytics = {"total": len(df), "referring_domains": None, "dofollow": None, "nofollow": None,
+                 "top_domains": pd.DataFrame(), "anchors": pd.DataFrame(), "ref_domains": pd.Index([])}
+    hosts = referring_hosts(df)
+    if hosts is not None:
+        counts = hosts.value_counts()
+        analytics["referring_domains"] = len(counts)
+        analytics["ref_domains"] = pd.Index(counts.index)
+        analytics["top_domains"] = counts.head(top_n).rename_axis("Referring Domain").reset_index(name="Backlinks")
+    flags = nofollow_flags(df)
+    if flags is not None:
+        analytics["nofollow"] = int(flags.sum())
+        analytics["dofollow"] = len(df) - analytics["nofollow"]
+    column = _find_column(df, BACKLINK_ANCHOR_COLUMNS)
+    if column is not None:
+        anchors = df[column].astype("string").fillna("(empty)").value_counts()
+        analytics["anchors"] = anchors.head(top_n).rename_axis("Anchor").reset_index(name="Backlinks")
+    return analytics
+
+# Function to compare the referring domains of the main domain with each competitor's
+def backlink_overlap(analytics_by_domain, main_domain):
+    main_refs = analytics_by_domain[main_domain]["ref_domains"]
+    rows = []
+    for d, analytics in analytics_by_domain.items():
+        if d == main_domain:
+            continue
+        refs = analytics["ref_domains"]
+        shared = len(refs.intersection(main_refs))
+        rows.append({
+            "Domain": d,
+            "Referring Domains": len(refs),
+            "Shared With Main Domain": shared,
+            "Competitor Only": len(refs) - shared,
+            "Overlap %": round(100 * shared / len(refs), 1) if len(refs) else 0.0,
+        })
+    return pd.DataFrame(rows)
+
 # Function to display data from a specific sheet
 def display_sheet_data(sheet_df, domain_name, data_type):
     if sheet_df is not None:
         st.subheader(f"{data_type} for {domain_name}")
-        st.dataframe(sheet_df, use_container_width=True)
+        render_dataframe(sheet_df, f"No {data_type.lower()} data available for {domain_name}.", key=f"{data_type}_{domain_name}")
         return sheet_df
     else:
         st.write(f"No {data_type.lower()} data available for {domain_name}.")
         return pd.DataFrame()
 
-# Function to create a downloadable Excel file
-def create_excel(domains_data):
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        for domain, data_dict in domains_data.items():
-            for sheet_name, df in data_dict.items():
-                if df is not None and not df.empty:  # Only write if DataFrame is not empty
-                    sanitized_name = sheet_name + '_' + domain.split('.')[0]
-                    df.to_excel(writer, sheet_name=sanitized_name[:31], index=False)
-    output.seek(0)
-    return output
+# Function to display the keyword gap between the main domain and its competitors
+def display_keyword_gap(gap, title):
+    if gap is None:
+        return
+    st.subheader(f"{title} Keyword Gap")
+    render_dataframe(gap["summary"], "No keyword data available.", key=f"{title}_gap_summary")
+    shared_tab, unique_tab, outranked_tab = st.tabs(["Shared", "Unique to a competitor", "Competitor outranks main"])
+    with shared_tab:
+        render_dataframe(gap["shared"], "No shared keywords.", key=f"{title}_gap_shared")
+    with unique_tab:
+        render_dataframe(gap["unique"], "No competitor-only keywords.", key=f"{title}_gap_unique")
+    with outranked_tab:
+        render_dataframe(gap["outranked"], "No keywords where a competitor outranks the main domain.", key=f"{title}_gap_outranked")
+
+# Function to display the backlink aggregates of a domain instead of its raw sheet
+def display_backlinks(analytics, sheet_df, domain_name):
+    st.subheader(f"Backlinks for {domain_name}")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Backlinks", f"{analytics['total']:,}")
+    col2.metric("Referring Domains", "N/A" if analytics["referring_domains"] is None else f"{analytics['referring_domains']:,}")
+    col3.metric("Dofollow", "N/A" if analytics["dofollow"] is None else f"{analytics['dofollow']:,}")
+    col4.metric("Nofollow", "N/A" if analytics["nofollow"] is None else f"{analytics['nofollow']:,}")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.caption("Top linking domains")
+        render_dataframe(analytics["top_domains"], "No referring domain column found.", key=f"Top linking domains_{domain_name}")
+    with col2:
+        st.caption("Anchor text distribution")
+        render_dataframe(analytics["anchors"], "No anchor column found.", key=f"Anchors_{domain_name}")
+    with st.expander(f"Backlink rows ({len(sheet_df):,})"):
+        render_dataframe(sheet_df, "No backlink rows.", key=f"Backlinks_{domain_name}")
+    return sheet_df
+
+# Function to list the non-empty tables of an export
+def _export_sheets(domains_data):
+    for domain, data_dict in domains_data.items():
+        for sheet_name, df in data_dict.items():
+            if df is not None and not df.empty:  # Only write if DataFrame is not empty
+                yield domain, sheet_name, df
+
+# Function to hash the content of every table of an export
+def frames_digest(domains_data):
+    digest = hashlib.sha256()
+    for domain, sheet_name, df in _export_sheets(domains_data):
+        digest.update(f"{domain}\0{sheet_name}\0{'|'.join(map(str, df.columns))}\0".encode("utf-8"))
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+# Function to combine digests of the parts of an export into one
+def combine_digests(*parts):
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+# Function to identify the uploaded sheets an export includes by content hash and matches, without hashing their frames
+def upload_digest(sheet_index, matches):
+    if sheet_index is None:
+        return ""
+    return f"{sheet_index.content_hash}:{sorted(matches.items())}"
+
+# Rows converted to plain Python values at a time while streaming a sheet
+EXPORT_CHUNK_ROWS = 10000
+
+# Function to fit a sheet name into Excel's 31 characters, numbering names that collide once truncated
+def unique_sheet_name(name, used):
+    candidate = name[:31]
+    counter = 2
+    while candidate.lower() in used:
+        suffix = f"~{counter}"
+        candidate = name[:31 - len(suffix)] + suffix
+        counter += 1
+    used.add(candidate.lower())
+    return candidate
+
+# Size of an Excel sheet; longer tables continue on numbered sheets, wider ones only fit CSV or Parquet
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLUMNS = 16384
+
+# Function to write an Excel file to a path, streamed row by row
+def create_excel(domains_data, path):
+    for domain, sheet_name, df in _export_sheets(domains_data):
+        if len(df.columns) > EXCEL_MAX_COLUMNS:
+            raise ValueError(f"{sheet_name} of {domain} has {len(df.columns):,} columns, more than an Excel sheet holds; "
+                             f"export it as CSV or Parquet instead.")
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True,
+                                          'default_date_format': 'yyyy-mm-dd'})
+    used_names = set()
+    for domain, sheet_name, df in _export_sheets(domains_data):
+        sanitized_name = sheet_name + '_' + domain.split('.')[0]
+        header = [str(column) for column in df.columns]
+        part = 1
+        row_idx = EXCEL_MAX_ROWS
+        for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+            chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS]
+            # constant_memory mode requires rows in order, and missing values become blank cells
+            for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+                if row_idx == EXCEL_MAX_ROWS:
+                    # The sheet is full (or not started): the table goes on in a numbered sheet with its own header
+                    suffix = f" ({part})" if part > 1 else ""
+                    worksheet = workbook.add_worksheet(unique_sheet_name(sanitized_name[:31 - len(suffix)] + suffix, used_names))
+                    worksheet.write_row(0, 0, header)
+                    row_idx = 1
+                    part += 1
+                if worksheet.write_row(row_idx, 0, row):
+                    # write_row stops at a rejected or truncated cell (text over 32,767 characters), so write each cell
+                    for col, value in enumerate(row):
+                        worksheet.write(row_idx, col, value)
+                row_idx += 1
+    workbook.close()
+    return path
+
+# Function to write a zip with one CSV per table to a path
+def create_csv_zip(domains_data, path):
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for domain, sheet_name, df in _export_sheets(domains_data):
+            with archive.open(f"{domain}/{sheet_name}.csv", "w") as entry, TextIOWrapper(entry, encoding="utf-8", newline="") as text:
+                df.to_csv(text, index=False)
+    return path
+
+# Function to write a zip with one Parquet file per table to a path
+def create_parquet_zip(domains_data, path):
+    # Parquet files are already compressed, so they are stored as-is
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as archive:
+        for domain, sheet_name, df in _export_sheets(domains_data):
+            with archive.open(f"{domain}/{sheet_name}.parquet", "w") as entry:
+                df.to_parquet(entry, index=False)
+    return path
+
+# Export formats: (builder, file extension, MIME type)
+EXPORT_FORMATS = {
+    "Excel": (create_excel, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV (zip)": (create_csv_zip, "zip", "application/zip"),
+}
+if HAS_PYARROW:
+    EXPORT_FORMATS["Parquet (zip)"] = (create_parquet_zip, "zip", "application/zip")
+
+# Export files kept on disk; older ones are deleted as new ones are built
+EXPORT_MAX_FILES = 8
+
+# Function to delete all but the newest export files
+def prune_exports(export_dir, keep=EXPORT_MAX_FILES):
+    paths = sorted((os.path.join(export_dir, name) for name in os.listdir(export_dir) if not name.startswith(".")),
+                   key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# Function to build an export file on disk once per content digest and format, returning its path
+@st.cache_resource(max_entries=EXPORT_MAX_FILES, show_spinner="Preparing export...")
+def build_export(digest, export_format, _domains_data):
+    build_fn, extension, _ = EXPORT_FORMATS[export_format]
+    export_dir = os.path.join(CACHE_DIR, "exports")
+    os.makedirs(export_dir, exist_ok=True)
+    file_name = f"{digest}-{re.sub(r'[^a-z]', '', export_format.lower())}.{extension}"
+    path = os.path.join(export_dir, file_name)
+    if not os.path.exists(path):
+        with get_metrics().measure("export", export_format) as counts:
+            # Written under a hidden name and renamed, so a half-written file is never served
+            tmp_path = os.path.join(export_dir, f".{threading.get_ident()}-{file_name}")
+            build_fn(_domains_data, tmp_path)
+            os.replace(tmp_path, path)
+            counts["bytes"] += os.path.getsize(path)
+        prune_exports(export_dir, keep=EXPORT_MAX_FILES * 2)
+    return path
+
+# Function to offer an export that is only built once the user asks for it; digest identifies its content.
+# download_button reads the whole file into memory, so it is only shown in the run the user asked for it;
+# later reruns skip it, and preparing the same export again reuses the file on disk
+def display_export(domains_data, title, file_stem, key, digest):
+    st.subheader(f"Download {title} Data")
+    col1, col2 = st.columns(2)
+    export_format = col1.selectbox("Export format", list(EXPORT_FORMATS), key=f"{key}_export_format")
+    if col2.button("Prepare download", key=f"{key}_prepare_export"):
+        _, extension, mime = EXPORT_FORMATS[export_format]
+        try:
+            path = build_export(digest, export_format, domains_data)
+            if not os.path.exists(path):
+                # The file was pruned while its path was still cached
+                build_export.clear()
+                path = build_export(digest, export_format, domains_data)
+        except ValueError as exc:
+            st.error(str(exc))
+            return
+        with open(path, "rb") as f:
+            st.download_button(label=f"Download {export_format}", data=f,
+                               file_name=f"{file_stem}.{extension}", mime=mime, key=f"{key}_download")
+
+# Function to time a single fetch call, holding one request slot, returning SpyFu errors as the result
+def _timed_call(slots, fetch_fn, *args):
+    with slots:
+        FETCH_SLOTS.set(slots)
+        start = time.perf_counter()
+        try:
+            result = fetch_fn(*args)
+        except SpyFuError as exc:
+            result = exc
+        return result, time.perf_counter() - start
+
+# Function to yield (key, result, elapsed) for each fetch job as soon as it completes;
+# jobs and their page prefetches share max_workers request slots, or the slots passed in
+def iter_fetch(jobs, max_workers=8, slots=None):
+    slots = slots if slots is not None else threading.BoundedSemaphore(max(1, max_workers))
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs) or 1)))
+    try:
+        futures = {executor.submit(_timed_call, slots, fetch_fn, *args): key for key, (fetch_fn, args) in jobs.items()}
+        for future in as_completed(futures):
+            result, elapsed = future.result()
+            yield futures[future], result, elapsed
+    finally:
+        # Abandon whatever is still queued when the consumer stops early
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# Function to run all (domain, endpoint) fetches concurrently under a concurrency cap
+def fetch_all(jobs, max_workers=8, slots=None):
+    results = {}
+    timings = {}
+    start = time.perf_counter()
+    for key, result, elapsed in iter_fetch(jobs, max_workers, slots):
+        results[key] = result
+        timings[key] = elapsed
+    return results, timings, time.perf_counter() - start
+
+# Section order of each domain
+SEO_ENDPOINTS = ["domain_stats", "valuable_keywords", "newly_ranked_keywords", "gained_clicks_keywords"]
+SEA_ENDPOINTS = ["domain_stats", "ppc_keywords", "ad_history"]
+
+# Tables each endpoint's section renders: (title, builder, message when empty)
+SECTION_TABLES = {
+    "valuable_keywords": [('Most Valuable Keywords', build_keywords_df, "No valuable keyword data available.")],
+    "newly_ranked_keywords": [('Newly Ranked Keywords', build_newly_ranked_keywords_df, "No newly ranked keyword data available.")],
+    "gained_clicks_keywords": [('Gained Clicks Keywords', build_gained_clicks_keywords_df, "No gained clicks keyword data available.")],
+    "ppc_keywords": [('Most Successful PPC Keywords', build_ppc_keywords_df, "No PPC keyword data available.")],
+    "ad_history": [
+        ('Google Ads History', build_ad_history_df, "No keyword data available."),
+        ('Top Ads', build_top_ads_df, "No top ads data available."),
+    ],
+}
+
+# Endpoints whose keywords feed the keyword gap engine
+GAP_ENDPOINTS = ("valuable_keywords", "ppc_keywords")
+
+# Function to normalize a fetched payload into the stats, tables and gap frame its section renders
+def normalize_section(endpoint, data):
+    section = {"stats": None, "tables": {}, "gap": None}
+    if endpoint == "domain_stats":
+        section["stats"] = domain_stats_record(data)
+    for title, build_fn, _ in SECTION_TABLES.get(endpoint, []):
+        section["tables"][title] = build_fn(data)
+    if endpoint in GAP_ENDPOINTS:
+        section["gap"] = build_keyword_gap_df(data)
+    return section
+
+# Function to fetch a payload and normalize it, both in the worker thread
+def fetch_section(endpoint, metrics, fetch_fn, *args):
+    with metrics.measure("fetch", endpoint):
+        data = fetch_fn(*args)
+    with metrics.measure("normalize", endpoint) as counts:
+        section = normalize_section(endpoint, data)
+        counts["rows"] += sum(len(df) for df in section["tables"].values())
+    return section
+
+# Function to turn fetch jobs, keyed by tuples ending with the endpoint, into jobs returning normalized sections;
+# the metrics are resolved on the script thread, since the jobs run on worker threads
+def section_jobs(jobs, metrics):
+    return {key: (fetch_section, (key[-1], metrics, fetch_fn) + args) for key, (fetch_fn, args) in jobs.items()}
+
+# Function to build the SEO fetch jobs for every domain
+def build_seo_jobs(domains, client, month, year, country_code, keyword_limit=None):
+    limit_args = (keyword_limit,) if keyword_limit else ()
+    jobs = {}
+    for d in domains:
+        jobs[(d, "domain_stats")] = (get_domain_stats, (client, d, month, year, country_code))
+        jobs[(d, "valuable_keywords")] = (get_valuable_keywords, (client, d, country_code) + limit_args)
+        jobs[(d, "newly_ranked_keywords")] = (get_newly_ranked_keywords, (client, d, country_code) + limit_args)
+        jobs[(d, "gained_clicks_keywords")] = (get_gained_clicks_keywords, (client, d, country_code) + limit_args)
+    return jobs
+
+# Function to build the SEA fetch jobs for every domain
+def build_sea_jobs(domains, client, month, year, country_code, keyword_limit=None):
+    limit_args = (keyword_limit,) if keyword_limit else ()
+    jobs = {}
+    for d in domains:
+        jobs[(d, "domain_stats")] = (get_sea_stats, (client, d, month, year, country_code))
+        jobs[(d, "ppc_keywords")] = (get_most_successful_ppc_keywords, (client, d, country_code) + limit_args)
+        jobs[(d, "ad_history")] = (get_ad_history_with_metrics, (client, d, country_code))
+    return jobs
+
+# Function to build the SEO and SEA fetch jobs of every (domain, country, endpoint) combination
+def build_market_jobs(domains, countries, client, month, year, keyword_limit=None):
+    jobs = {}
+    for country in countries:
+        country_jobs = build_seo_jobs(domains, client, month, year, country, keyword_limit)
+        country_jobs.update(build_sea_jobs(domains, client, month, year, country, keyword_limit))
+        for (d, endpoint), job in country_jobs.items():
+            jobs[(d, country, endpoint)] = job
+    return jobs
+
+# Function to show a failed (domain, endpoint) or (domain, country, endpoint) fetch in its section
+def display_fetch_error(key, error):
+    domain, endpoint = key[0], key[-1]
+    if len(key) == 3:
+        domain = f"{domain} ({key[1]})"
+    kind = {
+        SpyFuRateLimitError: "Rate limited",
+        SpyFuServerError: "SpyFu unavailable",
+        SpyFuClientError: "Request rejected",
+        SpyFuCircuitOpenError: "Requests paused",
+    }.get(type(error), "Request failed")
+    st.error(f"{kind} for {endpoint.replace('_', ' ')} of {domain}: {error}")
+
+# Function to summarize the average latency of each endpoint
+def format_endpoint_latency(timings):
+    by_endpoint = {}
+    for key, elapsed in timings.items():
+        by_endpoint.setdefault(key[-1], []).append(elapsed)
+    return " | ".join(f"{endpoint}: {sum(values) / len(values):.2f}s avg ({len(values)})"
+                      for endpoint, values in by_endpoint.items())
+
+# Function to render a section, or its fetch error, into its placeholder
+def fill_placeholder(placeholder, key, section, render_section):
+    with get_metrics().measure("render", key[-1]), placeholder.container():
+        if isinstance(section, SpyFuError):
+            display_fetch_error(key, section)
+        else:
+            render_section(key, section)
+
+# Function to fetch jobs concurrently and render each section into its placeholder as it arrives,
+# or only report progress when there are no placeholders
+def stream_fetch(jobs, placeholders, render_section, max_workers, cancel_key):
+    status = st.empty()
+    with status.container():
+        progress = st.progress(0.0, text=f"Fetching 0/{len(jobs)} requests")
+        latency = st.empty()
+        # Clicking cancel reruns the script, which closes the fetch and abandons queued requests
+        st.button("Cancel", key=cancel_key)
+
+    sections = {}
+    timings = {}
+    start = time.perf_counter()
+    with closing(iter_fetch(jobs, max_workers)) as fetches:
+        for done, (key, section, elapsed) in enumerate(fetches, start=1):
+            timings[key] = elapsed
+            sections[key] = section
+            if placeholders is not None:
+                fill_placeholder(placeholders[key], key, section, render_section)
+            progress.progress(done / len(jobs), text=f"Fetching {done}/{len(jobs)} requests")
+            latency.caption(format_endpoint_latency(timings))
+    total_time = time.perf_counter() - start
+
+    with status.container():
+        display_fetch_timing(timings, total_time)
+        st.caption(format_endpoint_latency(timings))
+    return sections, timings, total_time
+
+# Function to label a domain the way its section headers show it
+def domain_labels(domain, competitor_domains):
+    labels = {domain: domain}
+    for idx, competitor in enumerate(competitor_domains):
+        labels.setdefault(competitor, f"Competitor {idx + 1}: {competitor}")
+    return list(labels), labels
+
+# Function to render the tables of a section
+def render_section_tables(endpoint, section, label):
+    for title, _, empty_message in SECTION_TABLES[endpoint]:
+        st.subheader(f"{title} for {label}")
+        render_dataframe(section["tables"][title], empty_message, key=f"{title} for {label}")
+
+# Function to render one SEO (domain, endpoint) section
+def render_seo_section(endpoint, section, domain, label, backlinks_df=None):
+    if endpoint == "domain_stats":
+        st.subheader(f"KPIs for {label}")
+        if section["stats"] is not None:
+            display_kpis(section["stats"], domain, backlinks_df)
+        return
+    render_section_tables(endpoint, section, label)
+
+# Function to render one SEA (domain, endpoint) section
+def render_sea_section(endpoint, section, domain, label):
+    if endpoint == "domain_stats":
+        st.subheader(f"SEA KPIs for {label}")
+        display_sea_kpis(section["stats"], domain)
+        return
+    render_section_tables(endpoint, section, label)
+
+# Function to collect the export tables of a run, per domain in section order
+def run_tables(run, endpoints):
+    domains_data = {}
+    for d in run["domains"]:
+        domain_data = {}
+        for endpoint in endpoints:
+            section = run["sections"].get((d, endpoint))
+            if isinstance(section, dict):
+                domain_data.update(section["tables"])
+        domains_data[d] = domain_data
+    return domains_data
+
+# Function to run the keyword gap engine over the keyword sections of a run
+def run_keyword_gap(run, main_domain, endpoint):
+    frames = {d: section["gap"] for (d, e), section in run["sections"].items()
+              if e == endpoint and isinstance(section, dict)}
+    if main_domain not in frames or len(frames) < 2:
+        return None
+    return keyword_gap(frames, main_domain)
+
+# KPIs compared across markets: (column name, domain stats field)
+MARKET_KPIS = [
+    ("Organic Rank", "averageOrganicRank"),
+    ("Organic Results", "totalOrganicResults"),
+    ("Organic Clicks", "monthlyOrganicClicks"),
+    ("Paid Keywords", "totalAdsPurchased"),
+    ("PPC Clicks", "monthlyPaidClicks"),
+    ("PPC Budget", "monthlyBudget"),
+]
+
+# Function to put the Domain and Country columns first, as ordered categories, and sort by them
+def _market_order(df, domains, countries):
+    df["Domain"] = pd.Categorical(df["Domain"], categories=domains, ordered=True)
+    df["Country"] = pd.Categorical(df["Country"], categories=countries, ordered=True)
+    columns = ["Domain", "Country"] + [c for c in df.columns if c not in ("Domain", "Country")]
+    return df[columns].sort_values(["Domain", "Country"], kind="stable", ignore_index=True)
+
+# Function to merge the sections of a market run into long-format frames with Domain and Country columns
+def market_frames(sections, domains, countries):
+    kpi_rows = []
+    parts = {}
+    for (d, country, endpoint), section in sections.items():
+        if isinstance(section, SpyFuError):
+            continue
+        if section["stats"] is not None:
+            kpi_rows.append({"Domain": d, "Country": country,
+                             **{title: section["stats"].get(field) for title, field in MARKET_KPIS}})
+        for title, df in section["tables"].items():
+            parts.setdefault(title, []).append(df.assign(Domain=d, Country=country))
+
+    frames = {"KPIs": _market_order(pd.DataFrame(kpi_rows, columns=["Domain", "Country"] + [t for t, _ in MARKET_KPIS]),
+                                    domains, countries)}
+    for endpoint_tables in SECTION_TABLES.values():
+        for title, _, _ in endpoint_tables:
+            if title not in parts:
+                continue
+            non_empty = [df for df in parts[title] if not df.empty] or parts[title][:1]
+            long_df = pd.concat(non_empty, ignore_index=True)
+            # Categories differ per domain, so concat falls back to object; restore them on the merged frame
+            for column, dtype in non_empty[0].dtypes.items():
+                if isinstance(dtype, pd.CategoricalDtype):
+                    long_df[column] = long_df[column].astype("category")
+            frames[title] = _market_order(long_df, domains, countries)
+    return frames
+
+# Function to compare markets side by side: KPIs per country and row counts and volumes per table
+def display_market_comparison(frames, countries):
+    kpis = frames["KPIs"]
+    st.subheader("KPIs by Market")
+    if kpis.empty:
+        st.write("No KPI data available.")
+    else:
+        side_by_side = kpis.pivot_table(index="Domain", columns="Country", values=[t for t, _ in MARKET_KPIS],
+                                        aggfunc="first", observed=True)
+        side_by_side = side_by_side.reindex(columns=[(t, c) for t, _ in MARKET_KPIS for c in countries
+                                                     if (t, c) in side_by_side.columns])
+        side_by_side.columns = [f"{title} ({country})" for title, country in side_by_side.columns]
+        render_dataframe(side_by_side, "No KPI data available.", key="market_KPIs")
+
+    for title, long_df in frames.items():
+        if title == "KPIs":
+            continue
+        st.subheader(f"{title} by Market")
+        if long_df.empty:
+            st.write(f"No {title.lower()} data available.")
+            continue
+        grouped = long_df.groupby(["Domain", "Country"], observed=False)
+        summary = grouped.size().unstack("Country").add_prefix("Rows (").add_suffix(")").rename_axis(columns=None)
+        if "Search Volume" in long_df:
+            volume = grouped["Search Volume"].sum().unstack("Country")
+            summary = summary.join(volume.add_prefix("Search Volume (").add_suffix(")"))
+        render_dataframe(summary, f"No {title.lower()} data available.", key=f"market_{title}_summary")
+        with st.expander(f"All {title.lower()} rows"):
+            render_dataframe(long_df, f"No {title.lower()} data available.", key=f"market_{title}")
+
+RESULT_STORE_MAX_BYTES = int(os.environ.get("RESULT_STORE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Function to estimate the memory held by the frames of a run
+def run_memory_bytes(run):
+    frames = []
+    for section in run["sections"].values():
+        if isinstance(section, dict):
+            frames.extend(section["tables"].values())
+            frames.append(section["gap"])
+    for gap in (run.get("gap") or {}).values():
+        frames.extend((gap or {}).values())
+    frames.extend((run.get("frames") or {}).values())
+    return sum(int(df.memory_usage(deep=True).sum()) for df in frames if df is not None)
+
+# Session result store: normalized runs keyed by query, evicted least recently used past a memory budget
+class ResultStore:
+    def __init__(self, max_bytes=RESULT_STORE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._runs = OrderedDict()
+
+    def get(self, key):
+        run = self._runs.get(key)
+        if run is not None:
+            self._runs.move_to_end(key)
+        return run
+
+    def put(self, key, run):
+        run["size"] = run_memory_bytes(run)
+        self._runs[key] = run
+        self._runs.move_to_end(key)
+        # Always keep the newest run, even when it alone exceeds the budget
+        while len(self._runs) > 1 and self.total_bytes() > self.max_bytes:
+            self._runs.popitem(last=False)
+
+    def total_bytes(self):
+        return sum(run["size"] for run in self._runs.values())
+
+    def __len__(self):
+        return len(self._runs)
+
+# Function to get this session's result store
+def get_result_store():
+    if "result_store" not in st.session_state:
+        st.session_state["result_store"] = ResultStore()
+    return st.session_state["result_store"]
+
+# Function to report total fetch time next to the sum of per-request times
+def display_fetch_timing(timings, total_time):
+    st.caption(f"Fetched {len(timings)} requests in {total_time:.2f}s "
+               f"(sum of per-request times: {sum(timings.values()):.2f}s)")
+
+# Function to show connection reuse against new handshakes in the sidebar
+def display_client_stats(client):
+    st.sidebar.caption(f"SpyFu connections: {client.new_connections} new handshakes, "
+                       f"{client.reused_connections} reused, {client.coalesced_requests} coalesced, "
+                       f"{client.retries} retried")
+    if client.cache is not None:
+        st.sidebar.caption(f"Response cache: {client.cache.hits} hits, {client.cache.misses} misses "
+                           f"({client.cache.size() / 1024 / 1024:.1f} MB on disk)")
+    result_store = get_result_store()
+    st.sidebar.caption(f"Stored results: {len(result_store)} runs, {result_store.total_bytes() / 1024 / 1024:.1f} MB")
+
+# Function to show the pipeline metrics in a debug panel, with a JSON export for monitoring
+def display_metrics_panel(metrics):
+    with st.expander("Debug: pipeline metrics"):
+        snapshot = metrics.snapshot()
+        requests = [row for row in snapshot["metrics"] if row["stage"] == "request"]
+        hits = sum(row["cache_hits"] for row in requests)
+        lookups = sum(row["calls"] for row in requests if row["cache_hit_rate"] is not None)
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("API requests", sum(row["calls"] for row in requests))
+        col2.metric("Bytes transferred", f"{snapshot['totals']['bytes'] / 1024 / 1024:.2f} MB")
+        col3.metric("Cache hit rate", f"{hits / lookups:.0%}" if lookups else "N/A")
+        col4.metric("Est. SpyFu credits", f"{snapshot['totals']['credits']:,.0f}")
+        if snapshot["metrics"]:
+            summary_df = pd.DataFrame(snapshot["metrics"])
+            summary_df["statuses"] = summary_df["statuses"].map(
+                lambda statuses: ", ".join(f"{status}: {count}" for status, count in statuses.items()))
+            st.dataframe(summary_df, hide_index=True)
+        else:
+            st.write("No metrics recorded yet.")
+        col1, col2 = st.columns(2)
+        col1.download_button("Download metrics JSON", data=json.dumps(snapshot, indent=2),
+                             file_name="spyfu_metrics.json", mime="application/json", key="metrics_download")
+        if col2.button("Reset metrics", key="metrics_reset"):
+            metrics.reset()
+            st.rerun()
+
+
+# Years offered by the month/year selectors
+YEAR_OPTIONS = list(range(2020, datetime.now().year + 1))
+DEFAULT_YEAR_INDEX = YEAR_OPTIONS.index(2024)
+
+# Local store of monthly domain stats, so trend views only fetch the months they are missing
+class TimeSeriesStore:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS domain_stats ("
+            "domain TEXT, country TEXT, year INTEGER, month INTEGER, stats TEXT, fetched_at REAL, "
+            "PRIMARY KEY (domain, country, year, month))")
+        self._db.commit()
+
+    def stored_months(self, domains, country):
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT domain, year, month FROM domain_stats WHERE country = ? AND domain IN ({','.join('?' * len(domains))})",
+                [country, *domains]).fetchall()
+        return set(rows)
+
+    def put(self, domain, country, year, month, stats):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO domain_stats VALUES (?, ?, ?, ?, ?, ?)",
+                             (domain, country, year, month, json.dumps(stats), time.time()))
+            self._db.commit()
+
+    def load(self, domains, country, months):
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT domain, year, month, stats FROM domain_stats WHERE country = ? AND domain IN ({','.join('?' * len(domains))})",
+                [country, *domains]).fetchall()
+        wanted = set(months)
+        records = [{"domain": d, "date": pd.Timestamp(year=y, month=m, day=1), **json.loads(stats)}
+                   for d, y, m, stats in rows if (y, m) in wanted]
+        return pd.DataFrame.from_records(records)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+# Function to get the local time-series store shared by every session
+@st.cache_resource
+def get_time_series_store():
+    store = TimeSeriesStore(os.path.join(CACHE_DIR, "spyfu_timeseries.sqlite"))
+    atexit.register(store.close)
+    return store
+
+# Function to list the (year, month) pairs of an inclusive range
+def month_range(start_year, start_month, end_year, end_month):
+    months = []
+    year, month = start_year, start_month
+    while (year, month) <= (end_year, end_month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+# Function to fetch the domain stats missing from the store, in parallel
+def backfill_domain_stats(store, domains, months, client, country_code, max_workers=8):
+    today = datetime.now()
+    stored = store.stored_months(domains, country_code)
+    jobs = {}
+    for d in domains:
+        for year, month in months:
+            # The current month is still moving, so it is refetched instead of served from the store
+            if (d, year, month) not in stored or (year, month) == (today.year, today.month):
+                jobs[(d, (year, month))] = (get_domain_stats, (client, d, month, year, country_code))
+    results, _, _ = fetch_all(jobs, max_workers) if jobs else ({}, {}, 0.0)
+    errors = []
+    for (d, (year, month)), data in results.items():
+        if isinstance(data, SpyFuError):
+            errors.append(data)
+            continue
+        stats = domain_stats_record(data)
+        if stats is not None:
+            store.put(d, country_code, year, month, stats)
+    return len(jobs), errors
+
+# Trend charts: (chart title, stats field)
+TREND_METRICS = [
+    ("Organic Rank", "averageOrganicRank"),
+    ("Organic Clicks", "monthlyOrganicClicks"),
+    ("PPC Budget", "monthlyBudget"),
+]
+
+# Function to display one trend chart per metric across the main domain and its competitors
+def display_trend_charts(trends_df, domains):
+    if trends_df.empty:
+        st.write("No trend data available.")
+        return
+    for title, field in TREND_METRICS:
+        st.subheader(title)
+        if field not in trends_df:
+            st.write(f"No {title.lower()} data available.")
+            continue
+        chart_df = trends_df.pivot_table(index="date", columns="domain", values=field, aggfunc="last")
+        st.line_chart(chart_df[[d for d in domains if d in chart_df.columns]])
+
+# Function to fetch and normalize every SEO and SEA table of one domain, within the given request slots
+def fetch_domain_tables(domain, client, month, year, country_code, keyword_limit=None, slots=None):
+    jobs = build_seo_jobs([domain], client, month, year, country_code, keyword_limit)
+    jobs.update(build_sea_jobs([domain], client, month, year, country_code, keyword_limit))
+    results, _, _ = fetch_all(jobs, max_workers=len(jobs), slots=slots)
+    for result in results.values():
+        if isinstance(result, SpyFuError):
+            raise result
+    stats = domain_stats_record(results[(domain, "domain_stats")])
+    stats_df = pd.DataFrame([stats] if stats else [])
+    stats_df.insert(0, "domain", domain)
+    stats_df["month"], stats_df["year"], stats_df["countryCode"] = month, year, country_code
+    return {
+        "domain_stats": stats_df,
+        "valuable_keywords": build_keywords_df(results[(domain, "valuable_keywords")]),
+        "newly_ranked_keywords": build_newly_ranked_keywords_df(results[(domain, "newly_ranked_keywords")]),
+        "gained_clicks_keywords": build_gained_clicks_keywords_df(results[(domain, "gained_clicks_keywords")]),
+        "ppc_keywords": build_ppc_keywords_df(results[(domain, "ppc_keywords")]),
+        "ad_history": build_ad_history_df(results[(domain, "ad_history")]),
+        "top_ads": build_top_ads_df(results[(domain, "ad_history")]),
+    }
+
+# Function to write a table in a columnar format, Parquet when pyarrow is available
+def write_table(df, path_stem):
+    if HAS_PYARROW:
+        df.to_parquet(f"{path_stem}.parquet", index=False)
+    else:
+        df.to_csv(f"{path_stem}.csv", index=False)
+
+# Function to load the domains a previous batch run with the same parameters already completed
+def load_checkpoint(path, params):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    return set(checkpoint["completed"]) if checkpoint.get("params") == params else set()
+
+# Function to atomically record the completed domains of a batch run
+def save_checkpoint(path, params, completed):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"params": params, "completed": sorted(completed)}, f, indent=2)
+    os.replace(tmp_path, path)
+
+# Headless batch mode: python main.py batch --domains file.txt --month 6 --year 2024 --country FR --out dir/
+def run_batch(argv):
+    parser = argparse.ArgumentParser(prog="main.py batch", description="Fetch SpyFu data for a list of domains without the UI.")
+    parser.add_argument("--domains", required=True, help="Text file with one domain per line")
+    parser.add_argument("--month", type=int, required=True)
+    parser.add_argument("--year", type=int, required=True)
+    parser.add_argument("--country", default="FR")
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--workers", type=int, default=4, help="Domains fetched in parallel")
+    parser.add_argument("--max-requests", type=int, default=8, help="Requests in flight at once, across all domains")
+    parser.add_argument("--keyword-limit", type=int, default=None, help="Keyword rows per endpoint")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint of a previous run")
+    args = parser.parse_args(argv)
+
+    with open(args.domains, encoding="utf-8") as f:
+        domains = list(dict.fromkeys(line.strip() for line in f if line.strip() and not line.startswith("#")))
+
+    os.makedirs(args.out, exist_ok=True)
+    checkpoint_path = os.path.join(args.out, "checkpoint.json")
+    params = {"month": args.month, "year": args.year, "country": args.country, "keyword_limit": args.keyword_limit}
+    completed = set() if args.restart else load_checkpoint(checkpoint_path, params)
+    pending = [d for d in domains if d not in completed]
+    print(f"{len(domains)} domains, {len(domains) - len(pending)} already completed, {len(pending)} to fetch")
+
+    # The client is resolved here, on the main thread, and shared by every domain's fetch jobs
+    client = get_spyfu_client(SPYFU_API_ID, SPYFU_SECRET_KEY)
+    # Every domain's requests, page prefetches included, share one cap
+    slots = threading.BoundedSemaphore(max(1, args.max_requests))
+
+    def process(domain):
+        tables = fetch_domain_tables(domain, client, args.month, args.year, args.country, args.keyword_limit, slots)
+        domain_dir = os.path.join(args.out, domain.replace(os.sep, "_"))
+        os.makedirs(domain_dir, exist_ok=True)
+        for name, df in tables.items():
+            write_table(df, os.path.join(domain_dir, name))
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(process, d): d for d in pending}
+        for future in as_completed(futures):
+            domain = futures[future]
+            try:
+                future.result()
+            except Exception as exc:
+                failures += 1
+                print(f"FAILED {domain}: {exc}", file=sys.stderr)
+                continue
+            completed.add(domain)
+            save_checkpoint(checkpoint_path, params, completed)
+            print(f"done {domain} ({len(completed)}/{len(domains)})")
+    with open(os.path.join(args.out, "metrics.json"), "w", encoding="utf-8") as f:
+        json.dump(get_metrics().snapshot(), f, indent=2)
+    return 1 if failures else 0
 
 
 # Streamlit App
 def main():
+    # Set page layout to full width
+    st.set_page_config(layout="wide")
+
     st.title("Domain KPI and Competitors Dashboard")
 
     # Input for API ID and Secret Key
-    api_id = "356b218d-0d19-412c-83aa-2fafa98384cb"
-    secret_key = "J6VPTMMZ"
+    api_id = SPYFU_API_ID
+    secret_key = SPYFU_SECRET_KEY
+    client = get_spyfu_client(api_id, secret_key)
     domain = st.text_input("Enter the main domain", "lidl.fr")
 
     # Country Code Selection
     country_codes = ['AR', 'AU', 'BR', 'CA', 'DE', 'ES', 'FR', 'IE', 'IN', 'IT', 'JP', 'MX', 'NL', 'NZ', 'SG', 'UA', 'UK', 'US', 'ZA']
-    country_code = st.selectbox("Select Country Code", country_codes, index=6, key="country_select")  # Default to FR
+    countries = st.multiselect("Select Country Codes", country_codes, default=["FR"], key="country_select",
+                               help="The SEO, SEA and Trends tabs use the first country; pick several to compare markets")
+    countries = countries or ["FR"]  # Default to FR
+    country_code = countries[0]
 
     # Input for competitors
     competitor_domains = get_competitor_domains()
 
+    # Concurrency cap for the fetch scheduler
+    max_workers = st.sidebar.number_input("Max concurrent requests", min_value=1, max_value=64, value=8, step=1)
+
+    # Row limit for the paginated keyword endpoints
+    keyword_limit = st.sidebar.number_input("Keyword rows per endpoint", min_value=0, max_value=100000, value=0, step=100,
+                                            help="0 keeps each endpoint's default page size")
+
     # Create tabs for SEO and SEA overview
-    tab1, tab2 = st.tabs(["SEO Overview", "SEA Overview"])
+    tab1, tab2, tab3, tab4 = st.tabs(["SEO Overview", "SEA Overview", "Trends", "Market Comparison"])
 
-    # Dictionary to store data for each domain for export
+    # Dictionaries to store SEO, SEA and market data for export
     domains_data = {}
+    sea_domains_data = {}
+    market_data = {}
+    result_store = get_result_store()
 
     # SEO Overview Tab
     with tab1:
@@ -349,182 +2165,201 @@ def main():
         # Input for month and year selection
         col1, col2 = st.columns(2)
         month = col1.selectbox("Select Month", list(range(1, 13)), index=5, key="month_select")  # Default is June (month 6)
-        year = col2.selectbox("Select Year", list(range(2024, 2025)), index=0, key="year_select")  # Default is 2020
-
-        if st.button("Get SEO Data", key="get_seo_data"):
+        year = col2.selectbox("Select Year", YEAR_OPTIONS, index=DEFAULT_YEAR_INDEX, key="year_select")  # Default is 2024
+
+        # Results are kept per query, so reruns from unrelated widgets re-render without fetching
+        domains, labels = domain_labels(domain, competitor_domains)
+        seo_key = ("seo", tuple(domains), month, year, country_code, keyword_limit)
+        fetch_requested = st.button("Get SEO Data", key="get_seo_data")
+        run = result_store.get(seo_key)
+        if fetch_requested or run is not None:
             if api_id and secret_key and domain:
-                st.subheader(f"KPIs for {domain}")
-
-                # Dictionary to store the main domain's data for export
-                domain_data = {}
-
-                # Fetch and display organic metrics and backlinks KPI for the main domain
-                data = get_domain_stats(domain, api_id, secret_key, month, year, country_code)
-                if data and "results" in data and data["results"]:
-                    stats = data["results"][0]
-                    main_backlinks_data = backlinks_data[list(backlinks_data.keys())[0]] if backlinks_data else None
-                    display_kpis(stats, domain, main_backlinks_data)
-
-                # Fetch and display most valuable keywords for the main domain
-                keywords_data = get_valuable_keywords(domain, api_id, secret_key, country_code)
-                st.subheader(f"Most Valuable Keywords for {domain}")
-                keywords_df = display_keywords(keywords_data)
-                domain_data['Most Valuable Keywords'] = keywords_df
-
-                # Fetch and display newly ranked keywords for the main domain
-                new_keywords_data = get_newly_ranked_keywords(domain, api_id, secret_key, country_code)
-                st.subheader(f"Newly Ranked Keywords for {domain}")
-                newly_ranked_df = display_newly_ranked_keywords(new_keywords_data)
-                domain_data['Newly Ranked Keywords'] = newly_ranked_df
-
-                # Fetch and display gained clicks keywords for the main domain
-                gained_clicks_keywords_data = get_gained_clicks_keywords(domain, api_id, secret_key, country_code)
-                st.subheader(f"Gained Clicks Keywords for {domain}")
-                gained_clicks_df = display_gained_clicks_keywords(gained_clicks_keywords_data)
-                domain_data['Gained Clicks Keywords'] = gained_clicks_df
-
-                # Display backlinks and top pages for the main domain
-                if backlinks_data is not None:
-                    main_backlinks_df = display_sheet_data(main_backlinks_data, domain, "Backlinks")
-                    domain_data['Backlinks'] = main_backlinks_df
-                if top_pages_data is not None:
-                    main_top_pages_data = top_pages_data[list(top_pages_data.keys())[0]]  # First sheet is main domain
-                    main_top_pages_df = display_sheet_data(main_top_pages_data, domain, "Top Pages")
-                    domain_data['Top Pages'] = main_top_pages_df
-
-                # Save the main domain's data to the overall dictionary
-                domains_data[domain] = domain_data
-
-                # Loop through competitors
-                for idx, competitor in enumerate(competitor_domains):
-                    st.subheader(f"KPIs for Competitor {idx + 1}: {competitor}")
-
-                    # Dictionary to store the competitor's data for export
-                    competitor_data = {}
-
-                    # Fetch and display organic metrics and backlinks KPI for the competitor
-                    competitor_data_api = get_domain_stats(competitor, api_id, secret_key, month, year, country_code)
-                    if competitor_data_api and "results" in competitor_data_api and competitor_data_api["results"]:
-                        stats = competitor_data_api["results"][0]
-                        competitor_backlinks_data = backlinks_data[list(backlinks_data.keys())[idx + 1]] if backlinks_data and len(backlinks_data) > idx + 1 else None
-                        display_kpis(stats, competitor, competitor_backlinks_data)
-
-                    # Fetch and display most valuable keywords for the competitor
-                    competitor_keywords_data = get_valuable_keywords(competitor, api_id, secret_key, country_code)
-                    st.subheader(f"Most Valuable Keywords for Competitor {idx + 1}: {competitor}")
-                    competitor_keywords_df = display_keywords(competitor_keywords_data)
-                    competitor_data['Most Valuable Keywords'] = competitor_keywords_df
-
-                    # Fetch and display newly ranked keywords for the competitor
-                    competitor_new_keywords_data = get_newly_ranked_keywords(competitor, api_id, secret_key, country_code)
-                    st.subheader(f"Newly Ranked Keywords for Competitor {idx + 1}: {competitor}")
-                    competitor_newly_ranked_df = display_newly_ranked_keywords(competitor_new_keywords_data)
-                    competitor_data['Newly Ranked Keywords'] = competitor_newly_ranked_df
-
-                    # Fetch and display gained clicks keywords for the competitor
-                    competitor_gained_clicks_keywords_data = get_gained_clicks_keywords(competitor, api_id, secret_key, country_code)
-                    st.subheader(f"Gained Clicks Keywords for Competitor {idx + 1}: {competitor}")
-                    competitor_gained_clicks_df = display_gained_clicks_keywords(competitor_gained_clicks_keywords_data)
-                    competitor_data['Gained Clicks Keywords'] = competitor_gained_clicks_df
-
-                    # Display backlinks and top pages for each competitor
-                    if competitor_backlinks_data is not None:
-                        competitor_backlinks_df = display_sheet_data(competitor_backlinks_data, competitor, "Backlinks")
-                        competitor_data['Backlinks'] = competitor_backlinks_df
-                    if top_pages_data is not None and len(top_pages_data) > idx + 1:
-                        competitor_top_pages_data = top_pages_data[list(top_pages_data.keys())[idx + 1]]
-                        competitor_top_pages_df = display_sheet_data(competitor_top_pages_data, competitor, "Top Pages")
-                        competitor_data['Top Pages'] = competitor_top_pages_df
-
-                    # Save the competitor's data to the overall dictionary
-                    domains_data[competitor] = competitor_data
-
-    # Allow user to download the data as an Excel file
-    if domains_data:
-        st.subheader("Download SEO Data as Excel")
-        excel_data = create_excel(domains_data)
-        st.download_button(label="Download Excel", data=excel_data, file_name="domains_data_seo.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                # Uploaded sheets are matched to domains through their sheet name or domain column
+                backlinks_sheets = match_upload_sheets(backlinks_data, domains, "Backlinks")
+                top_pages_sheets = match_upload_sheets(top_pages_data, domains, "Top Pages")
+
+                # Reserve a placeholder for every (domain, endpoint) section up front
+                placeholders = {}
+                upload_frames = {}
+                sheet_frames = {}
+                backlink_analytics = {}
+                status_area = st.container()
+                for d in domains:
+                    for endpoint in SEO_ENDPOINTS:
+                        placeholders[(d, endpoint)] = st.empty()
+                    sheet_frames[d] = backlinks_data.sheets[backlinks_sheets[d]] if d in backlinks_sheets else None
+
+                    # Display backlinks and top pages, which need no fetch
+                    upload_frames[d] = {}
+                    if sheet_frames[d] is not None:
+                        backlink_analytics[d] = backlinks_data.analytics(backlinks_sheets[d])
+                        upload_frames[d]['Backlinks'] = display_backlinks(backlink_analytics[d], sheet_frames[d], d)
+                    if d in top_pages_sheets:
+                        upload_frames[d]['Top Pages'] = display_sheet_data(top_pages_data.sheets[top_pages_sheets[d]], d, "Top Pages")
+
+                def render_section(key, section):
+                    d, endpoint = key
+                    render_seo_section(endpoint, section, d, labels[d], sheet_frames[d])
+
+                with status_area:
+                    if fetch_requested:
+                        # Fetch every (domain, endpoint) pair concurrently and render each as it arrives
+                        sections, timings, total_time = stream_fetch(
+                            section_jobs(build_seo_jobs(domains, client, month, year, country_code, keyword_limit), get_metrics()),
+                            placeholders, render_section, max_workers, "cancel_seo")
+                        run = {"domains": domains, "sections": sections, "timings": timings, "total_time": total_time}
+                        run["gap"] = {"valuable_keywords": run_keyword_gap(run, domain, "valuable_keywords")}
+                        run["digest"] = frames_digest(run_tables(run, SEO_ENDPOINTS))
+                        result_store.put(seo_key, run)
+                    else:
+                        st.caption(f"Showing stored results ({len(run['timings'])} requests fetched in {run['total_time']:.2f}s)")
+                        for key, section in run["sections"].items():
+                            fill_placeholder(placeholders[key], key, section, render_section)
+
+                # Compare the main domain's keywords with every competitor's
+                display_keyword_gap(run["gap"]["valuable_keywords"], "SEO")
+
+                # Compare referring domains between the main domain and each competitor
+                if domain in backlink_analytics and len(backlink_analytics) > 1:
+                    st.subheader("Referring Domain Overlap")
+                    render_dataframe(backlink_overlap(backlink_analytics, domain), "No referring domain data available.",
+                                     key="referring_domain_overlap")
+
+                # Save each domain's data to the overall dictionary in section order
+                domains_data = run_tables(run, SEO_ENDPOINTS)
+                for d in domains:
+                    domains_data[d].update(upload_frames[d])
+                # Uploaded sheets are identified by content hash, so no frame is hashed on reruns
+                seo_digest = combine_digests(run["digest"], upload_digest(backlinks_data, backlinks_sheets),
+                                             upload_digest(top_pages_data, top_pages_sheets))
+
+        # Allow user to download the data once they ask for it
+        if domains_data:
+            display_export(domains_data, "SEO", "domains_data_seo", "seo", seo_digest)
 
     # SEA Overview Tab
     with tab2:
         st.subheader("SEA Data")
         col1, col2 = st.columns(2)
         month = col1.selectbox("Select Month", list(range(1, 13)), index=5, key="sea_month_select")
-        year = col2.selectbox("Select Year", list(range(2024, 2025)), index=0, key="sea_year_select")
-
-        # Dictionary to store SEA data for each domain
-        sea_domains_data = {}
+        year = col2.selectbox("Select Year", YEAR_OPTIONS, index=DEFAULT_YEAR_INDEX, key="sea_year_select")
 
-        if st.button("Get SEA Data", key="get_sea_data"):
+        domains, labels = domain_labels(domain, competitor_domains)
+        sea_key = ("sea", tuple(domains), month, year, country_code, keyword_limit)
+        fetch_requested = st.button("Get SEA Data", key="get_sea_data")
+        run = result_store.get(sea_key)
+        if fetch_requested or run is not None:
             if api_id and secret_key and domain:
-                st.subheader(f"SEA KPIs for {domain}")
-
-                # Fetch and display SEA data for the main domain
-                sea_data = get_sea_stats(domain, api_id, secret_key, month, year, country_code)
-                display_sea_kpis(sea_data, domain)
-
-                # Save the main domain's SEA data to the sea_domains_data dictionary
-                domain_sea_data = {}
-
-                # Fetch and display most successful PPC keywords for the main domain
-                ppc_data = get_most_successful_ppc_keywords(domain, api_id, secret_key, country_code)
-                st.subheader(f"Most Successful PPC Keywords for {domain}")
-                ppc_df = display_ppc_keywords(ppc_data)
-                domain_sea_data['Most Successful PPC Keywords'] = ppc_df
-
-                # Fetch and display ad history with metrics for the main domain
-                ad_history_data = get_ad_history_with_metrics(domain, api_id, secret_key)
-                st.subheader(f"Google Ads History for {domain}")
-                ad_history_df = display_keyword_data(ad_history_data)
-                domain_sea_data['Google Ads History'] = ad_history_df
-
-                # Fetch and display top ads for the main domain
-                st.subheader(f"Top Ads for {domain}")
-                top_ads_df = display_top_ads(ad_history_data)
-                domain_sea_data['Top Ads'] = top_ads_df
-
-                # Save the main domain's SEA data to the sea_domains_data dictionary
-                sea_domains_data[domain] = domain_sea_data
-
-                # Loop through competitors
-                for idx, competitor in enumerate(competitor_domains):
-                    st.subheader(f"SEA KPIs for Competitor {idx + 1}: {competitor}")
-
-                    # Dictionary to store the competitor's SEA data
-                    competitor_sea_data = {}
-
-                    # Fetch and display SEA data for each competitor
-                    competitor_sea_data_api = get_sea_stats(competitor, api_id, secret_key, month, year, country_code)
-                    display_sea_kpis(competitor_sea_data_api, competitor)
-
-                    # Fetch and display most successful PPC keywords for each competitor
-                    competitor_ppc_data = get_most_successful_ppc_keywords(competitor, api_id, secret_key, country_code)
-                    st.subheader(f"Most Successful PPC Keywords for Competitor {idx + 1}: {competitor}")
-                    competitor_ppc_df = display_ppc_keywords(competitor_ppc_data)
-                    competitor_sea_data['Most Successful PPC Keywords'] = competitor_ppc_df
-
-                    # Fetch and display ad history with metrics for each competitor
-                    competitor_ad_history_data = get_ad_history_with_metrics(competitor, api_id, secret_key)
-                    st.subheader(f"Google Ads History for Competitor {idx + 1}: {competitor}")
-                    competitor_ad_history_df = display_keyword_data(competitor_ad_history_data)
-                    competitor_sea_data['Google Ads History'] = competitor_ad_history_df
-
-                    # Fetch and display top ads for each competitor
-                    st.subheader(f"Top Ads for Competitor {idx + 1}: {competitor}")
-                    competitor_top_ads_df = display_top_ads(competitor_ad_history_data)
-                    competitor_sea_data['Top Ads'] = competitor_top_ads_df
-
-                    # Save the competitor's SEA data to the sea_domains_data dictionary
-                    sea_domains_data[competitor] = competitor_sea_data
-
-    # Allow user to download SEA data as an Excel file
-    if sea_domains_data:
-        st.subheader("Download SEA Data as Excel")
-        excel_data_sea = create_excel(sea_domains_data)
-        st.download_button(label="Download SEA Excel", data=excel_data_sea, file_name="domains_data_sea.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                # Reserve a placeholder for every (domain, endpoint) section up front
+                status_area = st.container()
+                placeholders = {(d, endpoint): st.empty() for d in domains for endpoint in SEA_ENDPOINTS}
+
+                def render_section(key, section):
+                    d, endpoint = key
+                    render_sea_section(endpoint, section, d, labels[d])
+
+                with status_area:
+                    if fetch_requested:
+                        # Fetch every (domain, endpoint) pair concurrently and render each as it arrives
+                        sections, timings, total_time = stream_fetch(
+                            section_jobs(build_sea_jobs(domains, client, month, year, country_code, keyword_limit), get_metrics()),
+                            placeholders, render_section, max_workers, "cancel_sea")
+                        run = {"domains": domains, "sections": sections, "timings": timings, "total_time": total_time}
+                        run["gap"] = {"ppc_keywords": run_keyword_gap(run, domain, "ppc_keywords")}
+                        run["digest"] = frames_digest(run_tables(run, SEA_ENDPOINTS))
+                        result_store.put(sea_key, run)
+                    else:
+                        st.caption(f"Showing stored results ({len(run['timings'])} requests fetched in {run['total_time']:.2f}s)")
+                        for key, section in run["sections"].items():
+                            fill_placeholder(placeholders[key], key, section, render_section)
+
+                # Compare the main domain's paid keywords with every competitor's
+                display_keyword_gap(run["gap"]["ppc_keywords"], "PPC")
+
+                # Save each domain's SEA data to the sea_domains_data dictionary in section order
+                sea_domains_data = run_tables(run, SEA_ENDPOINTS)
+                sea_digest = run["digest"]
+
+        # Allow user to download SEA data once they ask for it
+        if sea_domains_data:
+            display_export(sea_domains_data, "SEA", "domains_data_sea", "sea", sea_digest)
+
+    # Trends Tab
+    with tab3:
+        st.subheader("Monthly Trends")
+        col1, col2, col3, col4 = st.columns(4)
+        start_month = col1.selectbox("Start Month", list(range(1, 13)), index=0, key="trend_start_month")
+        start_year = col2.selectbox("Start Year", YEAR_OPTIONS, index=DEFAULT_YEAR_INDEX, key="trend_start_year")
+        end_month = col3.selectbox("End Month", list(range(1, 13)), index=5, key="trend_end_month")
+        end_year = col4.selectbox("End Year", YEAR_OPTIONS, index=DEFAULT_YEAR_INDEX, key="trend_end_year")
+
+        if st.button("Get Trend Data", key="get_trend_data"):
+            # Months after the current one have no data yet, so the range stops at the current month
+            today = datetime.now()
+            if (end_year, end_month) > (today.year, today.month):
+                end_year, end_month = today.year, today.month
+                st.caption(f"Months after {today.month}/{today.year} have no data yet and are left out.")
+            months = month_range(start_year, start_month, end_year, end_month)
+            if not months:
+                st.write("The start month must come before the end month.")
+            elif api_id and secret_key and domain:
+                domains, _ = domain_labels(domain, competitor_domains)
+                store = get_time_series_store()
+                with st.spinner("Fetching missing months..."):
+                    fetched, errors = backfill_domain_stats(store, domains, months, client, country_code,
+                                                            max_workers)
+                st.caption(f"{len(domains) * len(months)} domain-months, {fetched} fetched, "
+                           f"{len(domains) * len(months) - fetched} served from the local store")
+                for error in errors:
+                    st.error(str(error))
+                display_trend_charts(store.load(domains, country_code, months), domains)
+
+    # Market Comparison Tab
+    with tab4:
+        st.subheader("Market Comparison")
+        col1, col2 = st.columns(2)
+        month = col1.selectbox("Select Month", list(range(1, 13)), index=5, key="market_month_select")
+        year = col2.selectbox("Select Year", YEAR_OPTIONS, index=DEFAULT_YEAR_INDEX, key="market_year_select")
+
+        if len(countries) < 2:
+            st.write("Select two or more country codes to compare markets.")
+        else:
+            domains, _ = domain_labels(domain, competitor_domains)
+            market_key = ("market", tuple(domains), tuple(countries), month, year, keyword_limit)
+            fetch_requested = st.button("Compare Markets", key="get_market_data")
+            run = result_store.get(market_key)
+            if fetch_requested or run is not None:
+                if api_id and secret_key and domain:
+                    if fetch_requested:
+                        # Every (domain, country, endpoint) request goes out in one concurrent batch
+                        sections, timings, total_time = stream_fetch(
+                            section_jobs(build_market_jobs(domains, countries, client, month, year, keyword_limit), get_metrics()),
+                            None, None, max_workers, "cancel_market")
+                        # Only the merged frames and the errors are kept, not the per-request sections
+                        run = {"domains": domains, "timings": timings, "total_time": total_time,
+                               "sections": {key: section for key, section in sections.items() if isinstance(section, SpyFuError)},
+                               "frames": market_frames(sections, domains, countries)}
+                        run["digest"] = frames_digest({"markets": run["frames"]})
+                        result_store.put(market_key, run)
+                    else:
+                        st.caption(f"Showing stored results ({len(run['timings'])} requests fetched in {run['total_time']:.2f}s)")
+                    for key, error in run["sections"].items():
+                        display_fetch_error(key, error)
+
+                    market_data = run["frames"]
+                    display_market_comparison(market_data, countries)
+
+        # Allow user to download the long-format market tables once they ask for it
+        if market_data:
+            display_export({"markets": market_data}, "Market", "domains_data_markets", "market", run["digest"])
+
+    display_client_stats(client)
+    display_metrics_panel(get_metrics())
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(run_batch(sys.argv[2:]))
     main()
 
 